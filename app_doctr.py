@@ -1,19 +1,30 @@
-import copy
 from datetime import date
 import json
 import os
+import time
 
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
-from img2table.document import Image
-from img2table.ocr import DocTR
+import numpy as np
+import pandas as pd
 from PIL import Image as PILImage, ExifTags
-import requests
 import streamlit as st
 
 import msfocr.data.dhis2
 import msfocr.doctr.ocr_functions
 
+import dhis2_submission
+import field_names
+import inference
+import inference_server
+import model_store
+import profiling
+import session_tables
+import table_extraction
+import table_templates
+from word_index import WordIndex
+
+# Copies of the session tables share memory until they are modified
+pd.options.mode.copy_on_write = True
+
 def configure_secrets():
     """Checks that necessary environment variables are set for fast failing.
     Configures the DHIS2 server connection.
@@ -101,40 +112,8 @@ def correct_field_names(dfs):
     :param Data as dataframes
     :return Corrected data as dataframes
     """
-    dataElement_list = ['', 'Paed (0-59m) vacc target population', 'BCG', 'HepB (birth dose, within 24h)',
-            'HepB (birth dose, 24h or later)',
-            'Polio (OPV) 0 (birth dose)', 'Polio (OPV) 1 (from 6 wks)', 'Polio (OPV) 2', 'Polio (OPV) 3',
-            'Polio (IPV)', 'DTP+Hib+HepB (pentavalent) 1', 'DTP+Hib+HepB (pentavalent) 2',
-            'DTP+Hib+HepB (pentavalent) 3', 'DTP, TD, Td or TT booster', 'Measles 0', 'Measles 1',
-            'Measles 2', 'MMR 0', 'MMR 1', 'MMR 2', 'PCV 1', 'PCV 2', 'PCV 3', 'PCV booster']
-    categoryOptionsList = ['', '0-11m', '12-59m', '5-14y']
-    
-    for table in dfs:
-        for row in range(table.shape[0]):
-            max_similarity_dataElement = 0
-            dataElement = ""
-            text = table.iloc[row,0]
-            if text is not None:
-                for name in dataElement_list:
-                    sim = msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
-                    if max_similarity_dataElement < sim:
-                        max_similarity_dataElement = sim
-                        dataElement = name
-                table.iloc[row,0] = dataElement
-
-    for table in dfs:
-        for id,col in enumerate(table.columns):
-            max_similarity_catOpt = 0
-            catOpt = ""
-            text = table.iloc[0,id]
-            if text is not None:
-                for name in categoryOptionsList:
-                    sim = msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
-                    if max_similarity_catOpt < sim:
-                        max_similarity_catOpt = sim
-                        catOpt = name
-                table.iloc[0,id] = catOpt
-    return dfs        
+    return field_names.correct_field_names(dfs, field_names.VACCINATION_DATA_ELEMENTS,
+                                           field_names.VACCINATION_CATEGORY_OPTIONS)
 
 # Function to set the first row as header
 def set_first_row_as_header(df):
@@ -149,26 +128,102 @@ def set_first_row_as_header(df):
     # print(df)
     return df
 
-@st.cache_data
 def get_uploaded_images(tally_sheet):
     """
-    List of images uploaded by user as docTR DocumentFiles
+    Decodes each uploaded file once per session into an orientation-corrected RGB array. The same read-only array
+    is shared by the image display, docTR and img2table, so the upload is never decoded again.
     :param Files uploaded by user
-    :return List of images uploaded by user as docTR DocumentFiles
+    :return List of docTR documents, each a list holding the page array
     """
-    return [DocumentFile.from_images(sheet.read()) for sheet in tally_sheet]
+    decoded = st.session_state.get('pages', {})
+    pages = {}
+    for sheet in tally_sheet:
+        if sheet.file_id in decoded:
+            pages[sheet.file_id] = decoded[sheet.file_id]
+        else:
+            page = np.asarray(correct_image_orientation(sheet).convert("RGB"))
+            page.setflags(write=False)
+            pages[sheet.file_id] = page
+    # Pages of files that are no longer uploaded are released
+    st.session_state.pages = pages
+    return [[pages[sheet.file_id]] for sheet in tally_sheet]
 
 @st.cache_data
 def get_results(uploaded_images):
-    return [msfocr.doctr.ocr_functions.get_word_level_content(ocr_model, doc) for doc in uploaded_images]
+    """
+    Word level OCR of every page, by the shared inference service when it is running or else in-process
+    """
+    results = [inference_server.try_remote(inference_server.remote_ocr, doc[0]) for doc in uploaded_images]
+    if all(result is not inference_server.UNAVAILABLE for result in results):
+        return results
+    ocr_model = create_ocr()
+    with inference.inference_mode():
+        return [msfocr.doctr.ocr_functions.get_word_level_content(ocr_model, doc) for doc in uploaded_images]
+
+@st.cache_data
+def get_tabular_content_wrapper(page, _word_index):
+    # The word index is built from the OCR result of the same page, so page alone identifies the cache entry.
+    # Only table geometry is detected here, the words come from the OCR result, by the inference service or not
+    return table_extraction.get_tabular_content(page, _word_index)
+
+@st.cache_data
+def get_cell_boxes_wrapper(page):
+    return table_extraction.get_cell_boxes(table_extraction.ArrayImage(page))
+
+def get_header_images(uploaded_images):
+    """
+    Crops the header above the tables of every page, the only part that goes through text detection when the
+    table cells are recognized directly
+    """
+    return [[table_extraction.crop_header(doc[0], get_cell_boxes_wrapper(doc[0]))] for doc in uploaded_images]
+
+@st.cache_data
+def get_recognition_only_tabular_content_wrapper(page):
+    """
+    Recognizes the table cells of a page directly, the cells of its registered layout if it has one
+    """
+    tables = inference_server.try_remote(inference_server.remote_tables, page, "recognition")
+    if tables is not inference_server.UNAVAILABLE:
+        return tables
+    match = table_templates.match_template(page, get_table_templates())
+    ocr_model = create_ocr()
+    with inference.inference_mode():
+        if match is not None:
+            return table_templates.get_recognition_only_template_tabular_content(ocr_model, page, *match)
+        return table_extraction.get_recognition_only_tabular_content(ocr_model, page, get_cell_boxes_wrapper(page))
+
+@st.cache_resource
+def get_table_templates():
+    """
+    Load the registered tally sheet layouts once per process
+    """
+    return table_templates.load_templates()
 
 @st.cache_data
-def get_tabular_content_wrapper(_doctr_ocr, img, confidence_lookup_dict):
-    return msfocr.doctr.ocr_functions.get_tabular_content(_doctr_ocr, img, confidence_lookup_dict)
+def get_template_tabular_content_wrapper(page, _word_index):
+    """
+    Reads the tables of a page from the OCR words inside its template cells when the page matches a registered layout
+    :param Page as a numpy array
+    :param _word_index: WordIndex over the OCR result of the same page
+    :return (table_dfs, confidence_dfs), or (None, None) when the layout is unknown
+    """
+    match = table_templates.match_template(page, get_table_templates())
+    if match is None:
+        return None, None
+    return table_templates.get_template_tabular_content(_word_index, *match)
 
 def get_sheet_type_wrapper(result):
     return msfocr.doctr.ocr_functions.get_sheet_type(result)
 
+def get_submission_store():
+    """
+    Last imported data values of every form submitted from this session, so its resubmissions only send changes.
+    Other sessions and app replicas keep their own, see dhis2_submission
+    """
+    if "submission_store" not in st.session_state:
+        st.session_state["submission_store"] = dhis2_submission.SubmissionStore()
+    return st.session_state["submission_store"]
+
 @st.cache_data
 def get_data_sets(data_set_uids):
     return msfocr.data.dhis2.getDataSets(data_set_uids)
@@ -180,13 +235,14 @@ def get_org_unit_children(org_unit_id):
 @st.cache_resource
 def create_ocr():
     """
-    Load docTR ocr model and img2table docTR model  
+    Load docTR ocr model from the local model store, without network access.
     """
-    ocr_model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', pretrained=True)
-    doctr_ocr = DocTR(detect_language=False)
-    return ocr_model, doctr_ocr
+    start = time.perf_counter()
+    ocr_model, backend = inference.load_predictor(model_store.MODEL_STORE_DIR, inference.OCR_BACKEND,
+                                                  reco_bs=table_extraction.RECO_BATCH_SIZE)
+    print(f"OCR models ({backend}) loaded from {model_store.MODEL_STORE_DIR} in {time.perf_counter() - start:.2f}s")
+    return ocr_model
 
-@st.cache_data
 def correct_image_orientation(image_path):
     """
     Corrects the orientation of an image based on its EXIF data.
@@ -229,6 +285,13 @@ def week_from_date(date_object):
             week = 1
     return year, week
 
+def clear_tables():
+    """
+    Drops the tables read for the current upload, so they are read again on the next run
+    """
+    if 'table_dfs' in st.session_state:
+        del st.session_state['table_dfs']
+
 def get_period():
     year, week = week_from_date(period_start)
     return PERIOD_TYPES[period_type].format(
@@ -241,6 +304,9 @@ def get_period():
 # Set the page layout to centered
 # st.set_page_config(layout="wide")
 
+# Opt-in profiling of this script run, see profiling.py
+profiling.start_run_profile()
+
 # Initiation
 if 'upload_key' not in st.session_state: 
     st.session_state['upload_key'] = 1000
@@ -252,14 +318,19 @@ tally_sheet = st.file_uploader("Please upload one or more images of a tally shee
                                accept_multiple_files=True,
                                key=st.session_state['upload_key'])
 
+# Recognizing the detected table cells directly only runs text detection over the sheet header.
+# Switching modes reads the tables again
+recognition_only = st.checkbox("Fast table reading (recognize table cells only)", on_change=clear_tables)
+
+# Decode every upload once, the pages are shared by the display and both OCR stages
+uploaded_images = get_uploaded_images(tally_sheet)
+
 # Displaying images so the user can see them
 with st.expander("Show Images"):
-    for sheet in tally_sheet:
-        rotated_image = correct_image_orientation(sheet)
-        st.image(rotated_image)
+    for doc in uploaded_images:
+        st.image(doc[0])
 
-# OCR Model
-ocr_model, doctr_ocr = create_ocr()
+# OCR models are loaded on first use, unless the shared inference service is running
 configure_secrets()
 
 # Hardcoded Periods, probably won't update but can get them through API
@@ -289,12 +360,13 @@ if len(tally_sheet) > 0:
     
     if st.button("Clear Form") and 'upload_key' in st.session_state.keys():
         st.session_state.upload_key += 1
-        if 'table_dfs' in st.session_state:
-            del st.session_state['table_dfs']
+        clear_tables()
+        if 'pages' in st.session_state:
+            del st.session_state['pages']
         st.rerun()
         
-    uploaded_images = get_uploaded_images(tally_sheet)
-    results = get_results(uploaded_images)
+    # The sheet type is read from the header only when the tables are not read from the full page OCR
+    results = get_results(get_header_images(uploaded_images) if recognition_only else uploaded_images)
     
     ### CORRECT THIS TO ALLOW PROCESSING OF ALL IMAGES
     # ***************************************
@@ -380,16 +452,24 @@ if len(tally_sheet) > 0:
     # Populate streamlit with data recognized from tally sheets
     for result in results:
         # Get tabular data ad dataframes
-        confidence_lookup_dict = msfocr.doctr.ocr_functions.get_confidence_values(result)
         table_dfs = []
-        for sheet in tally_sheet:
-            img = Image(src=sheet)
-            table_df, confidence_df = get_tabular_content_wrapper(doctr_ocr, img, confidence_lookup_dict)
+        for sheet_idx, sheet in enumerate(tally_sheet):
+            # Known layouts skip generic table detection, anything else falls back to img2table
+            page = uploaded_images[sheet_idx][0]
+            if recognition_only:
+                table_df, confidence_df = get_recognition_only_tabular_content_wrapper(page)
+            else:
+                word_index = WordIndex.from_doctr_result(results[sheet_idx])
+                table_df, confidence_df = get_template_tabular_content_wrapper(page, word_index)
+                if table_df is None:
+                    table_df, confidence_df = get_tabular_content_wrapper(page, word_index)
             table_dfs += table_df
 
             # Store table data in session state
             if 'table_dfs' not in st.session_state:
-                st.session_state.table_dfs = table_dfs
+                st.session_state.table_dfs = session_tables.compact_tables(table_dfs)
+                print(f"Session tables: {session_tables.tables_memory_usage(table_dfs)} bytes as parsed, "
+                      f"{session_tables.tables_memory_usage(st.session_state.table_dfs)} bytes stored")
 
             # print(table_dfs)
 
@@ -422,8 +502,8 @@ if len(tally_sheet) > 0:
 
             # Rerun the code to display any edits made by user
             for idx, table in enumerate(table_dfs):
-                if not table_dfs[idx].equals(st.session_state.table_dfs[idx]):
-                    st.session_state.table_dfs = table_dfs
+                if not session_tables.tables_equal(table_dfs[idx], st.session_state.table_dfs[idx]):
+                    st.session_state.table_dfs = session_tables.compact_tables(table_dfs)
                     st.rerun()
 
             
@@ -440,7 +520,7 @@ if len(tally_sheet) > 0:
             # Generate and display key-value pairs
             if st.button("Generate Key-Value Pairs"):
                 # Set first row as header of df
-                final_dfs = copy.deepcopy(st.session_state.table_dfs)
+                final_dfs = [session_tables.expand_table(df) for df in st.session_state.table_dfs]
                 for id, table in enumerate(final_dfs):
                     final_dfs[id] = set_first_row_as_header(table)
                 print(final_dfs)
@@ -456,24 +536,14 @@ if len(tally_sheet) > 0:
                 if st.session_state.data_payload==None:
                     raise ValueError("Data empty - generate key value pairs first")
                 else:
-                    URL = ''
-                    ############# write this in OCR functions
-                    data_value_set_url = f'{URL}/api/dataValueSets?dryRun=true'
-                    # Send the POST request with the data payload
-                    response = requests.post(
-                        data_value_set_url,
-                        auth=('', ''),
-                        headers={'Content-Type': 'application/json'},
-                        data=st.session_state.data_payload
+                    # Send only the values changed since the last import of this form, gzip-compressed
+                    response, report = dhis2_submission.submit_data_values(
+                        msfocr.data.dhis2.DHIS2_SERVER_URL,
+                        (msfocr.data.dhis2.DHIS2_USERNAME, msfocr.data.dhis2.DHIS2_PASSWORD),
+                        st.session_state.data_payload,
+                        get_submission_store()
                     )
-
-                    # # Check the response status
-                    # if response.status_code == 200:
-                    #     print('Data entry dry run successful')
-                    #     print('Response data:')
-                    #     print(response.json())
-                    # else:
-                    #     print(f'Failed to enter data, status code: {response.status_code}')
-                    #     print('Response data:')
-                    #     print(response.json())
+                    st.write(dhis2_submission.format_report(report))
                     st.write("Completed")
+
+profiling.finish_run_profile()
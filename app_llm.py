@@ -1,16 +1,33 @@
+import concurrent.futures
 from datetime import date, datetime
-import copy
+import io
 import json
 import os
+import time
 
-import requests
+import numpy as np
+import pandas as pd
 import streamlit as st
 from simpleeval import simple_eval
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 import msfocr.data.dhis2
 import msfocr.doctr.ocr_functions
 import msfocr.llm.ocr_functions
 
+import dhis2_submission
+import engine_cascade
+import field_names
+import inference
+import inference_server
+import model_store
+import page_jobs
+import profiling
+import session_tables
+
+# Copies of the session tables share memory until they are modified
+pd.options.mode.copy_on_write = True
+
 PAGE_REVIEWED_INDICATOR = "✓"
 
 def configure_secrets():
@@ -68,9 +85,104 @@ def get_org_unit_children(org_unit_id):
     """
     return msfocr.data.dhis2.getOrgUnitChildren(org_unit_id)
 
-@st.cache_data(show_spinner=False)
-def get_results_wrapper(tally_sheet):
-    return msfocr.llm.ocr_functions.get_results(tally_sheet)
+def get_submission_store():
+    """
+    Last imported data values of every form submitted from this session, so its resubmissions only send changes.
+    Other sessions and app replicas keep their own, see dhis2_submission.
+    """
+    if "submission_store" not in st.session_state:
+        st.session_state["submission_store"] = dhis2_submission.SubmissionStore()
+    return st.session_state["submission_store"]
+
+class UploadCopy(io.BytesIO):
+    """
+    Copy of an uploaded file for a page job, so the job and the script run never move the same file position. Only
+    made when the job is started, not on the reruns that wait for it.
+    """
+
+    def __init__(self, sheet):
+        super().__init__(sheet.getvalue())
+        self.name = sheet.name
+        self.type = sheet.type
+
+def read_llm_page(sheet, checkpoint):
+    """
+    Page job reading the tables of a page with the LLM
+    :param sheet: Uploaded image of the page
+    :param checkpoint: Called before each stage, stops the job when its upload was cancelled
+    :return Table names and table dataframes
+    """
+    checkpoint("llm")
+    start = time.perf_counter()
+    results = msfocr.llm.ocr_functions.get_results([sheet])
+    engine_cascade.record_llm_latency(1, time.perf_counter() - start)
+    checkpoint("parse")
+    return msfocr.llm.ocr_functions.parse_table_data(results[0])
+
+def read_cascade_page(sheet, threshold, checkpoint):
+    """
+    Page job reading the tables of a page with docTR first and sending only the tables it is unsure of to the LLM,
+    see engine_cascade.py
+    :return Table names, table dataframes and cascade statistics of the page
+    """
+    checkpoint("decode")
+    page = np.asarray(msfocr.llm.ocr_functions.correct_image_orientation(sheet).convert("RGB"))
+    return engine_cascade.read_page(page, read_words, threshold, checkpoint)
+
+def get_cancellation_token(upload_key):
+    """
+    Cancellation token of the page jobs of this session's upload. A new upload key cancels the previous jobs.
+    """
+    token = st.session_state.get('cancellation_token')
+    if token is not None and token.upload_key != upload_key:
+        token.cancel()
+        token = None
+    if token is None:
+        token = page_jobs.CancellationToken(get_script_run_ctx().session_id, upload_key)
+        st.session_state.cancellation_token = token
+    return token
+
+def cancel_page_jobs():
+    if 'cancellation_token' in st.session_state:
+        st.session_state.cancellation_token.cancel()
+        del st.session_state['cancellation_token']
+
+def wait_for_pages(futures):
+    """
+    Waits for the page jobs of the upload. The progress bar is updated while waiting, which lets Streamlit stop
+    this script run as soon as the user clicks something, e.g. "Clear Form". The jobs keep running for the next run
+    unless that run cancels them.
+    :return Results of the jobs, in page order
+    """
+    progress = st.progress(0.0, text="Running image recognition...")
+    while True:
+        done, pending = concurrent.futures.wait(futures, timeout=page_jobs.POLL_INTERVAL)
+        if not pending:
+            break
+        progress.progress(len(done) / len(futures),
+                          text=f"Running image recognition... {len(done)} of {len(futures)} pages")
+    progress.empty()
+    return [future.result() for future in futures]
+
+@st.cache_resource(show_spinner=False)
+def create_ocr():
+    """
+    Load the docTR ocr model from the local model store, only needed by the engine cascade when the shared
+    inference service is not running.
+    """
+    ocr_model, backend = inference.load_predictor(model_store.MODEL_STORE_DIR, inference.OCR_BACKEND)
+    print(f"OCR model ({backend}) loaded from {model_store.MODEL_STORE_DIR}")
+    return ocr_model
+
+def read_words(page):
+    """
+    Word level OCR of a page, by the shared inference service when it is running or else in-process
+    """
+    result = inference_server.try_remote(inference_server.remote_ocr, page)
+    if result is inference_server.UNAVAILABLE:
+        with inference.inference_mode():
+            result = msfocr.doctr.ocr_functions.get_word_level_content(create_ocr(), [page])
+    return result
 
 @st.cache_data
 def getCategoryUIDs_wrapper(datasetid):
@@ -154,39 +266,13 @@ def json_export(kv_pairs):
 
 def correct_field_names(dfs):
     """
-    Corrects the text data in tables by replacing with closest match among the hardcoded fieldnames
+    Corrects the text data in tables by replacing with closest match among the fieldnames of the selected data set
     :param Data as dataframes
     :return Corrected data as dataframes
     """
     categoryOptionsList, dataElement_list = getCategoryUIDs_wrapper(data_set_selected_id)
     print(categoryOptionsList, dataElement_list)
-    
-    for table in dfs:
-        for row in range(table.shape[0]):
-            max_similarity_dataElement = 0
-            dataElement = ""
-            text = table.iloc[row,0]
-            if text is not None:
-                for name in dataElement_list:
-                    sim = msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
-                    if max_similarity_dataElement < sim:
-                        max_similarity_dataElement = sim
-                        dataElement = name
-                table.iloc[row,0] = dataElement
-
-    for table in dfs:
-        for id,col in enumerate(table.columns):
-            max_similarity_catOpt = 0
-            catOpt = ""
-            text = table.iloc[0,id]
-            if text is not None:
-                for name in categoryOptionsList:
-                    sim =  msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
-                    if max_similarity_catOpt < sim:
-                        max_similarity_catOpt = sim
-                        catOpt = name
-                table.iloc[0,id] = catOpt
-    return dfs        
+    return field_names.correct_field_names(dfs, dataElement_list, categoryOptionsList)
 
 # Function to set the first row as header
 def set_first_row_as_header(df):
@@ -201,15 +287,21 @@ def set_first_row_as_header(df):
     # print(df)
     return df
 
+def reset_tables():
+    for key in ['table_dfs', 'table_names', 'page_nums']:
+        if key in st.session_state:
+            del st.session_state[key]
+
 def save_st_table(table_dfs):
     for idx, table in enumerate(table_dfs):
-        if not table_dfs[idx].equals(st.session_state.table_dfs[idx]):
-            st.session_state.table_dfs = table_dfs
+        if not session_tables.tables_equal(table_dfs[idx], st.session_state.table_dfs[idx]):
+            st.session_state.table_dfs = session_tables.compact_tables(table_dfs)
             st.rerun()
             
 def evaluate_cells(table_dfs):
     for table in table_dfs:
-        table_removed_labels = table.loc[1:, 1:]
+        # Missing cells would be evaluated to "nan" and turn the numbers of their column into floats
+        table_removed_labels = table.loc[1:, 1:].fillna("")
         for col in table_removed_labels.columns:
             try:
                 table_removed_labels[col] = table_removed_labels[col].apply(lambda x: simple_eval(x) if x and x != "-" else x).astype("str")
@@ -218,9 +310,8 @@ def evaluate_cells(table_dfs):
         table.update(table_removed_labels)
     return table_dfs
 
-@st.cache_data
-def parse_table_data_wrapper(result):
-    return msfocr.llm.ocr_functions.parse_table_data(result)
+# Opt-in profiling of this script run, see profiling.py
+profiling.start_run_profile()
 
 # Initiation
 if "initialised" not in st.session_state:
@@ -281,6 +372,10 @@ if st.session_state['password_correct']:
                                 accept_multiple_files=True,
                                 key=st.session_state['upload_key'])
 
+    # Recognition of files that were removed from the uploader is no longer needed
+    if len(tally_sheet_images) == 0:
+        cancel_page_jobs()
+
     # Once images are uploaded
     if len(tally_sheet_images) > 0:
         
@@ -288,21 +383,36 @@ if st.session_state['password_correct']:
 
         if st.button("Clear Form", type='primary') and 'upload_key' in st.session_state.keys():
             st.session_state.upload_key += 1
-            if 'table_dfs' in st.session_state:
-                del st.session_state['table_dfs']
-            if 'table_names' in st.session_state:
-                del st.session_state['table_names']
-            if 'page_nums' in st.session_state:
-                del st.session_state['page_nums']
+            cancel_page_jobs()
+            reset_tables()
             st.rerun()
 
-        with st.spinner("Running image recognition..."):
-            results = get_results_wrapper(tally_sheet_images)
+        # Switching engines reads the sheets again
+        use_cascade = st.checkbox("Read with docTR first and only send uncertain tables to the LLM",
+                                  key="use_cascade", on_change=reset_tables)
+
+        # Every page is read by its own job, cancelled when the form is cleared or other files are uploaded
+        token = get_cancellation_token((st.session_state.upload_key,
+                                        tuple(sheet.file_id for sheet in tally_sheet_images), use_cascade))
+        if use_cascade:
+            page_results = wait_for_pages([
+                page_jobs.submit(token, i, profiling.profile_job(read_cascade_page),
+                                 lambda sheet=sheet: (UploadCopy(sheet), engine_cascade.CASCADE_THRESHOLD))
+                for i, sheet in enumerate(tally_sheet_images)
+            ])
+            st.caption(engine_cascade.format_stats(engine_cascade.summarize([stats for _, _, stats in page_results])))
+        else:
+            page_results = wait_for_pages([page_jobs.submit(token, i, profiling.profile_job(read_llm_page),
+                                                            lambda sheet=sheet: (UploadCopy(sheet),))
+                                           for i, sheet in enumerate(tally_sheet_images)])
 
-        # ***************************************
-        result = results[0]
-        
-        # print(results)
+        # Populate streamlit with data recognized from tally sheets
+        table_names, table_dfs, page_nums_to_display = [], [], []
+        for i, (names, dfs, *_) in enumerate(page_results):
+            table_names.extend(names)
+            # The jobs keep their results for later reruns, so the tables edited here are copies
+            table_dfs.extend(df.copy() for df in dfs)
+            page_nums_to_display.extend([str(i + 1)] * len(names))
 
         # Initialize from JSON result
         # dataSet = result.get('dataSet', None)
@@ -376,20 +486,14 @@ if st.session_state['password_correct']:
                 period_start = st.date_input("Period Start Date", format="YYYY-MM-DD", max_value=datetime.today())
 
 
-        # Populate streamlit with data recognized from tally sheets
-        table_names, table_dfs, page_nums_to_display = [], [], []
-        for i, result in enumerate(results):
-            names, df = parse_table_data_wrapper(result)
-            table_names.extend(names)
-            table_dfs.extend(df)
-            page_nums_to_display.extend([str(i + 1)] * len(names))
-        
         table_dfs = evaluate_cells(table_dfs)
 
         if 'table_names' not in st.session_state:
             st.session_state.table_names = table_names
         if 'table_dfs' not in st.session_state:
-            st.session_state.table_dfs = table_dfs
+            st.session_state.table_dfs = session_tables.compact_tables(table_dfs)
+            print(f"Session tables: {session_tables.tables_memory_usage(table_dfs)} bytes as parsed, "
+                  f"{session_tables.tables_memory_usage(st.session_state.table_dfs)} bytes stored")
         if 'page_nums' not in st.session_state:
             st.session_state.page_nums = page_nums_to_display
 
@@ -457,7 +561,7 @@ if st.session_state['password_correct']:
                 if all(PAGE_REVIEWED_INDICATOR in str(num) for num in st.session_state.page_nums):
                     try: 
                         with st.spinner("Uploading in progress, please wait..."):
-                            final_dfs = copy.deepcopy(st.session_state.table_dfs)
+                            final_dfs = [session_tables.expand_table(df) for df in st.session_state.table_dfs]
                             for id, table in enumerate(final_dfs):
                                 final_dfs[id] = set_first_row_as_header(table)
                             print(final_dfs)
@@ -468,17 +572,19 @@ if st.session_state['password_correct']:
                             
                         st.session_state.data_payload = json_export(key_value_pairs)
                         if st.session_state.data_payload is not None:
-                            data_value_set_url = f'{msfocr.data.dhis2.DHIS2_SERVER_URL}/api/dataValueSets?dryRun=true'
-                            # Send the POST request with the data payload
-                            response = requests.post(
-                                data_value_set_url,
-                                auth=(msfocr.data.dhis2.DHIS2_USERNAME, msfocr.data.dhis2.DHIS2_PASSWORD),
-                                headers={'Content-Type': 'application/json'},
-                                data=st.session_state.data_payload
+                            # Send only the values changed since the last import of this form, gzip-compressed
+                            response, report = dhis2_submission.submit_data_values(
+                                msfocr.data.dhis2.DHIS2_SERVER_URL,
+                                (msfocr.data.dhis2.DHIS2_USERNAME, msfocr.data.dhis2.DHIS2_PASSWORD),
+                                st.session_state.data_payload,
+                                get_submission_store()
                             )
+                            st.caption(dhis2_submission.format_report(report))
 
                         # # Check the response status
-                        if response.status_code == 200:
+                        if response is None:
+                            st.success("No changes since the last submission.")
+                        elif response.status_code == 200:
                             print('Response data:')
                             print(response.json())
                             st.success("Submitted!")
@@ -496,3 +602,4 @@ if st.session_state['password_correct']:
             else:
                 st.error("Please finish selecting organisation unit and data set.")
 
+profiling.finish_run_profile()
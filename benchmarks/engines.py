@@ -0,0 +1,205 @@
+"""
+Compares the docTR and LLM engines on a labeled corpus of tally sheets: cell accuracy, latency per page,
+throughput and estimated LLM token cost.
+
+The corpus is a directory with, for every image `<name>.jpg` (or .jpeg/.png):
+    <name>.json       ground truth, {"tables": [[["", "0-11m", ...], ["BCG", "3", ...], ...], ...]}
+    <name>.llm.json   recorded model answer, {"content": "...", "usage": {"prompt_tokens": ..,
+                      "completion_tokens": ..}, "latency": ..}; usage and latency are optional
+
+The LLM side runs offline: msfocr.llm.ocr_functions talks to a local OpenAI stand-in that replays the recording
+of the page being read. Both engines go through the same table parsing and correct_field_names steps.
+
+Usage (from the repository root):
+python -m benchmarks.engines path/to/corpus --input-price 2.5 --output-price 10
+"""
+import argparse
+import io
+import json
+import math
+import os
+from pathlib import Path
+import statistics
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# The OpenAI client reads its base URL when msfocr creates it, so the local stand-in's address is set before
+# anything imports msfocr
+LLM_STUB_PORT = int(os.environ.get("LLM_STUB_PORT", "8621"))
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{LLM_STUB_PORT}/v1"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import msfocr.doctr.ocr_functions
+import msfocr.llm.ocr_functions
+
+import field_names
+import inference
+from loadtest.stubs import OpenAIHandler, start_stub
+import model_store
+import table_extraction
+from word_index import WordIndex
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+# Rough size of the text prompt sent with every image when a recording has no usage
+PROMPT_TEXT_TOKENS = 300
+
+
+class UploadedImage(io.BytesIO):
+    """
+    In-memory stand-in for a Streamlit upload, with the name and type attributes of an UploadedFile.
+    """
+
+    def __init__(self, path):
+        super().__init__(Path(path).read_bytes())
+        self.name = Path(path).name
+        self.type = MIME_TYPES[Path(path).suffix.lower()]
+
+
+def estimate_image_tokens(width, height):
+    """
+    Prompt tokens of a high detail image for GPT-4o: the image is fit in 2048x2048, its short side scaled to 768,
+    then billed 170 tokens per 512px tile plus 85.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def cell_accuracy(predicted_dfs, truth_tables):
+    """
+    Fraction of ground truth cells whose predicted value matches, comparing tables in order. Empty cells match
+    missing values, and predicted tables or cells that do not exist count as wrong.
+
+    :return: (correct cells, ground truth cells)
+    """
+    normalize = lambda value: "" if value is None or (isinstance(value, float) and math.isnan(value)) \
+        else str(value).strip()
+    correct = total = 0
+    for t, truth in enumerate(truth_tables):
+        predicted = predicted_dfs[t].values.tolist() if t < len(predicted_dfs) else []
+        for r, row in enumerate(truth):
+            for c, value in enumerate(row):
+                total += 1
+                if r < len(predicted) and c < len(predicted[r]) and \
+                        normalize(predicted[r][c]) == normalize(value):
+                    correct += 1
+    return correct, total
+
+
+class DocTREngine:
+    name = "docTR"
+
+    def __init__(self, store_dir):
+        self.ocr_model, _ = inference.load_predictor(store_dir, inference.OCR_BACKEND,
+                                                     reco_bs=table_extraction.RECO_BATCH_SIZE)
+
+    def read(self, path, recording):
+        page = np.asarray(ImageOps.exif_transpose(Image.open(path)).convert("RGB"))
+        with inference.inference_mode():
+            result = msfocr.doctr.ocr_functions.get_word_level_content(self.ocr_model, [page])
+        table_dfs, _ = table_extraction.get_tabular_content(page, WordIndex.from_doctr_result(result))
+        return table_dfs, 0, 0
+
+
+class LLMEngine:
+    name = "LLM"
+
+    def __init__(self, stub):
+        self.stub = stub
+
+    def read(self, path, recording):
+        usage = recording.get("usage", {})
+        width, height = ImageOps.exif_transpose(Image.open(path)).size
+        prompt_tokens = usage.get("prompt_tokens", estimate_image_tokens(width, height) + PROMPT_TEXT_TOKENS)
+        completion_tokens = usage.get("completion_tokens", len(recording["content"]) // 4)
+        self.stub.llm_content = recording["content"]
+        self.stub.prompt_tokens = prompt_tokens
+        self.stub.latency = recording.get("latency", 0.0)
+
+        results = msfocr.llm.ocr_functions.get_results([UploadedImage(path)])
+        table_dfs = []
+        for result in results:
+            _, dfs = msfocr.llm.ocr_functions.parse_table_data(result)
+            table_dfs.extend(dfs)
+        return table_dfs, prompt_tokens, completion_tokens
+
+
+def run_engine(engine, corpus, correct_names):
+    """
+    Reads every page of the corpus with one engine.
+
+    :return: Dict with cell accuracy, latencies, throughput and token counts
+    """
+    correct = total = prompt_tokens = completion_tokens = 0
+    latencies = []
+    start = time.perf_counter()
+    for path, truth, recording in corpus:
+        if isinstance(engine, LLMEngine) and recording is None:
+            continue
+        page_start = time.perf_counter()
+        table_dfs, page_prompt, page_completion = engine.read(path, recording)
+        if correct_names:
+            table_dfs = field_names.correct_field_names(table_dfs, field_names.VACCINATION_DATA_ELEMENTS,
+                                                        field_names.VACCINATION_CATEGORY_OPTIONS)
+        latencies.append(time.perf_counter() - page_start)
+        page_correct, page_total = cell_accuracy(table_dfs, truth["tables"])
+        correct, total = correct + page_correct, total + page_total
+        prompt_tokens, completion_tokens = prompt_tokens + page_prompt, completion_tokens + page_completion
+    elapsed = time.perf_counter() - start
+    return {
+        "pages": len(latencies),
+        "accuracy": correct / total if total else float("nan"),
+        "latency": statistics.mean(latencies) if latencies else float("nan"),
+        "throughput": len(latencies) / elapsed if latencies else float("nan"),
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+    }
+
+
+def load_corpus(corpus_dir):
+    corpus = []
+    for path in sorted(p for p in Path(corpus_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES):
+        truth_path = path.with_suffix(".json")
+        if not truth_path.exists():
+            print(f"Skipping {path.name}, it has no ground truth")
+            continue
+        recording_path = path.with_suffix(".llm.json")
+        recording = json.loads(recording_path.read_text()) if recording_path.exists() else None
+        corpus.append((path, json.loads(truth_path.read_text()), recording))
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", help="Directory of labeled tally sheet images")
+    parser.add_argument("--store", default=model_store.MODEL_STORE_DIR)
+    parser.add_argument("--input-price", type=float, default=2.5, help="USD per million prompt tokens")
+    parser.add_argument("--output-price", type=float, default=10.0, help="USD per million completion tokens")
+    parser.add_argument("--no-correct-names", action="store_true", help="Skip the correct_field_names step")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        raise SystemExit(f"No labeled images found in {args.corpus}")
+
+    stub = start_stub(OpenAIHandler, port=LLM_STUB_PORT)
+
+    print(f"{'engine':>6} {'pages':>5} {'cell acc':>8} {'s/page':>7} {'pages/s':>7} {'tokens':>9} {'cost USD':>9}")
+    for engine in (DocTREngine(args.store), LLMEngine(stub)):
+        report = run_engine(engine, corpus, not args.no_correct_names)
+        tokens = report["prompt_tokens"] + report["completion_tokens"]
+        cost = (report["prompt_tokens"] * args.input_price + report["completion_tokens"] * args.output_price) / 1e6
+        print(f"{engine.name:>6} {report['pages']:>5} {report['accuracy']:>8.3f} {report['latency']:>7.2f} "
+              f"{report['throughput']:>7.2f} {tokens:>9} {cost:>9.4f}")
+    skipped = sum(recording is None for _, _, recording in corpus)
+    if skipped:
+        print(f"{skipped} pages have no LLM recording and were only read by docTR")
+
+
+if __name__ == "__main__":
+    main()
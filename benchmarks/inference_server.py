@@ -0,0 +1,103 @@
+"""
+Measures memory and throughput of 1, 2 and 4 app replicas doing word-level OCR, either each loading its own models
+(in-process) or all sharing one inference service.
+
+Usage (from the repository root):
+python -m benchmarks.inference_server path/to/sheets --pages-per-replica 8
+"""
+import argparse
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageOps
+import requests
+
+import inference
+import inference_server
+import model_store
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+
+def load_pages(image_dir):
+    paths = sorted(p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    return [np.asarray(ImageOps.exif_transpose(Image.open(p)).convert("RGB")) for p in paths]
+
+
+def replica(mode, image_dir, pages_per_replica, server_url, start_event):
+    """
+    One app replica. Loads its models when running in-process, then OCRs pages round-robin.
+
+    :return: Peak RSS of the replica in MiB
+    """
+    pages = load_pages(image_dir)
+    if mode == "in-process":
+        ocr_model, _ = inference.load_predictor(model_store.MODEL_STORE_DIR, inference.OCR_BACKEND)
+    start_event.wait()
+    for i in range(pages_per_replica):
+        page = pages[i % len(pages)]
+        if mode == "in-process":
+            with inference.inference_mode():
+                ocr_model([page])
+        else:
+            inference_server.remote_ocr(page, server_url)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(mode, replicas, args, server_url):
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    start_event = manager.Event()
+    with context.Pool(replicas) as pool:
+        pending = [pool.apply_async(replica, (mode, args.images, args.pages_per_replica, server_url, start_event))
+                   for _ in range(replicas)]
+        # Give every replica time to load before the timed section starts
+        time.sleep(args.warmup)
+        start = time.perf_counter()
+        start_event.set()
+        peak_rss = [p.get() for p in pending]
+        elapsed = time.perf_counter() - start
+    manager.shutdown()
+    return sum(peak_rss), replicas * args.pages_per_replica / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Directory of tally sheet photos")
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages-per-replica", type=int, default=8)
+    parser.add_argument("--warmup", type=float, default=30, help="Seconds allowed for replicas to load models")
+    parser.add_argument("--port", type=int, default=8611)
+    args = parser.parse_args()
+
+    server_url = f"http://127.0.0.1:{args.port}"
+    # Every replica sends the same pages, so the result cache would turn most shared calls into cache hits
+    server = subprocess.Popen([sys.executable, "inference_server.py", "--port", str(args.port),
+                               "--result-cache-size", "0"], env=os.environ)
+    try:
+        for _ in range(int(args.warmup * 10)):
+            try:
+                if requests.get(f"{server_url}/health", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                time.sleep(0.1)
+
+        print(f"{'replicas':>8} {'mode':>11} {'total RSS MB':>13} {'pages/s':>8}")
+        for replicas in args.replicas:
+            rss, throughput = run("in-process", replicas, args, server_url)
+            print(f"{replicas:>8} {'in-process':>11} {rss:>13.0f} {throughput:>8.2f}")
+            rss, throughput = run("shared", replicas, args, server_url)
+            server_rss = requests.get(f"{server_url}/health").json()["peak_rss_mb"]
+            print(f"{replicas:>8} {'shared':>11} {rss + server_rss:>13.0f} {throughput:>8.2f}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
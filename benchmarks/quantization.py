@@ -0,0 +1,111 @@
+"""
+Compares the int8 docTR backend against fp32 on a fixed set of sample tally sheets: latency per page, peak memory
+and character error rate of the int8 text against the fp32 text. With --write-gate the outcome is recorded in the
+model store, and the apps only use OCR_BACKEND=int8 when it passed.
+
+Usage (from the repository root):
+python -m benchmarks.quantization path/to/sample_sheets --max-cer 0.01 --write-gate
+"""
+import argparse
+import multiprocessing
+from pathlib import Path
+import resource
+import statistics
+import time
+
+from doctr.io import DocumentFile
+
+import inference
+import model_store
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance between two strings.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def run_backend(backend, paths, store_dir, threads, repeat):
+    """
+    Runs one backend over every page in a fresh process, so its peak RSS is not mixed with the other backend.
+
+    :return: Dict with the median latency per page, peak RSS in MiB and the recognized text of every page
+    """
+    # The benchmark has to run int8 before the gate exists, so it quantizes without checking the gate
+    inference.configure_threads(threads)
+    predictor = model_store.load_ocr_predictor(store_dir)
+    if backend == "int8":
+        predictor = inference.quantize_predictor(predictor)
+    latencies, texts = [], []
+    for path in paths:
+        doc = DocumentFile.from_images(Path(path).read_bytes())
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with inference.inference_mode():
+                result = predictor(doc)
+            timings.append(time.perf_counter() - start)
+        latencies.append(statistics.median(timings))
+        texts.append(result.render())
+    return {
+        "backend": backend,
+        "latency": statistics.mean(latencies),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "texts": texts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Directory of sample tally sheet photos")
+    parser.add_argument("--store", default=model_store.MODEL_STORE_DIR)
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads, 0 for one per core")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-cer", type=float, default=0.01, help="Largest character error rate allowed for int8")
+    parser.add_argument("--write-gate", action="store_true", help="Record the result in the model store")
+    args = parser.parse_args()
+
+    paths = sorted(str(p) for p in Path(args.images).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        fp32 = pool.apply(run_backend, ("fp32", paths, args.store, args.threads, args.repeat))
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        int8 = pool.apply(run_backend, ("int8", paths, args.store, args.threads, args.repeat))
+
+    errors = sum(edit_distance(q, f) for q, f in zip(int8["texts"], fp32["texts"]))
+    cer = errors / max(sum(len(f) for f in fp32["texts"]), 1)
+    passed = cer <= args.max_cer
+    for result in (fp32, int8):
+        print(f"{result['backend']}: {result['latency']:.3f}s per page, peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"int8 speedup: {fp32['latency'] / int8['latency']:.2f}x, "
+          f"character error rate against fp32: {cer:.4f} (limit {args.max_cer})")
+    print("int8 backend PASSED the accuracy gate" if passed else "int8 backend FAILED the accuracy gate")
+
+    if args.write_gate:
+        inference.write_gate({
+            "passed": passed,
+            "cer": cer,
+            "max_cer": args.max_cer,
+            "pages": len(paths),
+            "fp32_latency": fp32["latency"],
+            "int8_latency": int8["latency"],
+            "fp32_peak_rss_mb": fp32["peak_rss_mb"],
+            "int8_peak_rss_mb": int8["peak_rss_mb"],
+        }, args.store)
+        print(f"Gate written to {Path(args.store) / inference.GATE_FILE}")
+
+
+if __name__ == "__main__":
+    main()
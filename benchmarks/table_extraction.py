@@ -0,0 +1,89 @@
+"""
+Compares the time per page of generic img2table table extraction with the template registry path and with fast
+table reading, each timed from the decoded page to its tables, full page or header OCR included.
+
+Usage (from the repository root):
+python -m benchmarks.table_extraction path/to/sheets --repeat 3
+"""
+import argparse
+from pathlib import Path
+import statistics
+import time
+
+from doctr.io import DocumentFile
+
+import msfocr.doctr.ocr_functions
+
+import model_store
+import table_extraction
+import table_templates
+from word_index import WordIndex
+
+
+def time_call(fn, repeat):
+    """
+    Runs a function several times and returns the median wall time and the last return value.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="Directory of tally sheet photos")
+    parser.add_argument("--templates", default=table_templates.TEMPLATE_DIR)
+    parser.add_argument("--store", default=model_store.MODEL_STORE_DIR)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ocr_model = model_store.load_ocr_predictor(args.store)
+    templates = table_templates.load_templates(args.templates)
+
+    generic_times, template_times, fast_times = [], [], []
+    paths = sorted(p for p in Path(args.images).iterdir() if p.suffix.lower() in {".png", ".jpg", ".jpeg"})
+    for path in paths:
+        doc = DocumentFile.from_images(path.read_bytes())
+
+        # Each path is timed from the decoded page to its tables, full page OCR included, as the app runs it
+        def generic_path():
+            result = msfocr.doctr.ocr_functions.get_word_level_content(ocr_model, doc)
+            return table_extraction.get_tabular_content(doc[0], WordIndex.from_doctr_result(result))
+
+        def template_path():
+            result = msfocr.doctr.ocr_functions.get_word_level_content(ocr_model, doc)
+            match = table_templates.match_template(doc[0], templates)
+            if match is None:
+                return None
+            return table_templates.get_template_tabular_content(WordIndex.from_doctr_result(result), *match)
+
+        def fast_path():
+            cell_boxes = table_extraction.get_cell_boxes(table_extraction.ArrayImage(doc[0]))
+            header = table_extraction.crop_header(doc[0], cell_boxes)
+            msfocr.doctr.ocr_functions.get_word_level_content(ocr_model, [header])
+            return table_extraction.get_recognition_only_tabular_content(ocr_model, doc[0], cell_boxes)
+
+        generic, _ = time_call(generic_path, args.repeat)
+        generic_times.append(generic)
+        fast, _ = time_call(fast_path, args.repeat)
+        fast_times.append(fast)
+        templated, tables = time_call(template_path, args.repeat)
+        if tables is None:
+            print(f"{path.name}: generic {generic:.3f}s, fast {fast:.3f}s, no template matched")
+        else:
+            template_times.append(templated)
+            print(f"{path.name}: generic {generic:.3f}s, fast {fast:.3f}s, template {templated:.3f}s")
+
+    if generic_times:
+        print(f"Generic path: {statistics.mean(generic_times):.3f}s per page over {len(generic_times)} pages")
+    if fast_times:
+        print(f"Fast table reading: {statistics.mean(fast_times):.3f}s per page over {len(fast_times)} pages")
+    if template_times:
+        print(f"Template path: {statistics.mean(template_times):.3f}s per page over {len(template_times)} pages")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Submission of data value sets to DHIS2 for low-bandwidth sites.
+
+The last successfully imported values of every (dataSet, period, orgUnit) form are remembered, so a resubmission
+only sends the values that changed, and the request body is gzip-compressed.
+
+The remembered values only know about the imports made through the same store. Each app session has its own store,
+so when another session, app replica or the DHIS2 web interface changes a form in between, a value this session
+leaves unchanged is not sent again and the other change stays in DHIS2. To bound how long a store can be stale, a
+form whose last import is older than DELTA_MAX_AGE seconds is sent in full.
+"""
+import gzip
+import json
+import os
+import threading
+import time
+
+import requests
+
+DRY_RUN = os.environ.get("DHIS2_DRY_RUN", "true").lower() != "false"
+COMPRESS = os.environ.get("DHIS2_GZIP_UPLOADS", "true").lower() != "false"
+DELTA_MAX_AGE = float(os.environ.get("DHIS2_DELTA_MAX_AGE", "600"))
+
+
+class SubmissionStore:
+    """
+    Thread-safe record of the data values last imported for each form by one app session.
+
+    :param max_age: Seconds after an import during which its values are trusted to still be in DHIS2
+    """
+
+    def __init__(self, max_age=DELTA_MAX_AGE):
+        self._lock = threading.Lock()
+        self._forms = {}
+        self.max_age = max_age
+
+    def get(self, form_key):
+        """
+        :return: Dict of the data values last imported for the form keyed by value_key, empty when the form was not
+                 imported within max_age seconds
+        """
+        with self._lock:
+            imported_at, values = self._forms.get(form_key, (None, {}))
+            if imported_at is None or time.monotonic() - imported_at > self.max_age:
+                return {}
+            return dict(values)
+
+    def update(self, form_key, data_values):
+        with self._lock:
+            imported_at, values = self._forms.get(form_key, (None, {}))
+            if imported_at is None or time.monotonic() - imported_at > self.max_age:
+                # Values of an expired import were all sent again, the ones not sent back are gone from DHIS2
+                values = {}
+            for data_value in data_values:
+                if data_value.get("value") in ("", None):
+                    values.pop(value_key(data_value), None)
+                else:
+                    values[value_key(data_value)] = dict(data_value)
+            self._forms[form_key] = (time.monotonic(), values)
+
+
+def form_key(payload):
+    return payload.get("dataSet"), payload.get("period"), payload.get("orgUnit")
+
+
+def value_key(data_value):
+    return (data_value.get("dataElement"), data_value.get("categoryOptionCombo"),
+            data_value.get("attributeOptionCombo"))
+
+
+def changed_data_values(previous, data_values):
+    """
+    Finds the data values that differ from the last import of the same form.
+
+    Usage:
+    delta = changed_data_values(store.get(form_key(payload)), payload["dataValues"])
+
+    :param previous: Dict of previously imported data values keyed by value_key
+    :param data_values: Data values of the new submission
+    :return: New or changed data values, plus previously imported values that are now missing sent with an
+             empty value so DHIS2 deletes them
+    """
+    current = {value_key(data_value): data_value for data_value in data_values}
+    changed = [data_value for key, data_value in current.items()
+               if key not in previous or str(previous[key].get("value")) != str(data_value.get("value"))]
+    removed = [{**data_value, "value": ""} for key, data_value in previous.items() if key not in current]
+    return changed + removed
+
+
+def imported_data_values(response, data_values):
+    """
+    Finds the data values an import actually stored. DHIS2 can answer with status WARNING and ignore some values,
+    reported as conflicts or rejected indexes. Those must not be remembered, so they are sent again next time.
+
+    Usage:
+    store.update(form_key(payload), imported_data_values(response, delta))
+
+    :param response: requests.Response of a POST to /api/dataValueSets
+    :param data_values: Data values sent in that request, in order
+    :return: The data values that were imported, or an empty list when the summary does not say which were ignored
+    """
+    try:
+        body = response.json()
+    except ValueError:
+        return []
+    # DHIS2 2.38+ wraps the import summary in a web message
+    summary = body["response"] if isinstance(body.get("response"), dict) else body
+    if summary.get("status") not in ("SUCCESS", "WARNING"):
+        return []
+    rejected = set(summary.get("rejectedIndexes") or [])
+    conflicts = {conflict.get("object") for conflict in summary.get("conflicts") or []}
+    imported = [data_value for i, data_value in enumerate(data_values)
+                if i not in rejected and not conflicts.intersection(value_key(data_value))]
+    ignored = (summary.get("importCount") or {}).get("ignored", 0)
+    if len(data_values) - len(imported) < ignored:
+        # Some ignored values could not be matched, e.g. a conflict on the period or organisation unit
+        return []
+    return imported
+
+
+def submit_data_values(server_url, auth, payload, store, dry_run=DRY_RUN, compress=COMPRESS):
+    """
+    Posts a data value set to /api/dataValueSets, only sending the values that changed since the last successful
+    import of the same form through the store, or every value when that import is older than the store's max_age.
+    Dry runs are not remembered, since DHIS2 does not store their values, and neither are values the import summary
+    reports as ignored.
+
+    Usage:
+    response, report = submit_data_values(server_url, (username, password), payload, store)
+
+    :param server_url: Base URL of the DHIS2 server
+    :param auth: (username, password) tuple
+    :param payload: Data value set as a JSON string or dict
+    :param store: SubmissionStore
+    :param dry_run: Ask DHIS2 to validate the import without saving it
+    :param compress: gzip-compress the request body
+    :return: The requests.Response, or None if nothing changed, and a dict reporting the bytes sent and saved
+    """
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    key = form_key(payload)
+    delta = changed_data_values(store.get(key), payload["dataValues"])
+    full_size = len(json.dumps(payload).encode())
+    report = {"values": len(payload["dataValues"]), "values_sent": len(delta), "bytes_full": full_size,
+              "bytes_sent": 0, "bytes_saved": full_size}
+    if not delta:
+        return None, report
+
+    body = json.dumps({**payload, "dataValues": delta}).encode()
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    report["bytes_sent"] = len(body)
+    report["bytes_saved"] = full_size - len(body)
+
+    response = requests.post(
+        f"{server_url}/api/dataValueSets",
+        params={"dryRun": "true"} if dry_run else None,
+        auth=auth,
+        headers=headers,
+        data=body,
+    )
+    if not dry_run:
+        store.update(key, imported_data_values(response, delta))
+    return response, report
+
+
+def format_report(report):
+    """
+    One-line summary of a submission report for display in the app.
+    """
+    saved_pct = 100 * report["bytes_saved"] / report["bytes_full"] if report["bytes_full"] else 0
+    return (f"Sent {report['values_sent']} of {report['values']} data values, "
+            f"{report['bytes_sent']} of {report['bytes_full']} bytes ({saved_pct:.0f}% saved)")
@@ -0,0 +1,176 @@
+"""
+Confidence-based cascade of the two OCR engines for app_llm.py. Every page is read with docTR first, and only the
+tables holding a cell recognized below the confidence threshold are sent to the LLM, cropped from the page. Pages
+where no table is found go to the LLM whole. Clean sheets then cost no LLM call at all.
+"""
+import io
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import msfocr.llm.ocr_functions
+
+import table_extraction
+from word_index import WordIndex
+
+CASCADE_THRESHOLD = float(os.environ.get("CASCADE_THRESHOLD", "0.8"))
+# Pixels kept around a table crop so its labels and borders are not cut off
+TABLE_MARGIN = 20
+
+# LLM time per image seen by this process, used to estimate what reading every page with the LLM would take
+_llm_latency = {"images": 0, "seconds": 0.0}
+_llm_latency_lock = threading.Lock()
+
+
+class CropUpload(io.BytesIO):
+    """
+    PNG encoded crop of a page with the name and type attributes of a Streamlit UploadedFile, so it can be sent
+    to msfocr.llm.ocr_functions like an upload.
+    """
+
+    def __init__(self, crop, name):
+        super().__init__()
+        Image.fromarray(crop).save(self, format="PNG")
+        self.seek(0)
+        self.name = name
+        self.type = "image/png"
+
+
+def is_weak(confidence_df, threshold=CASCADE_THRESHOLD):
+    """
+    Whether docTR is unsure of a table: a recognized cell is below the threshold, or no cell was recognized at all.
+
+    :param confidence_df: Confidence dataframe of the table, None for empty cells
+    :param threshold: Lowest word confidence accepted from docTR
+    """
+    confidences = confidence_df.to_numpy(dtype=float, na_value=np.nan)
+    confidences = confidences[~np.isnan(confidences)]
+    return confidences.size == 0 or confidences.min() < threshold
+
+
+def crop_table(page, x1, y1, x2, y2, margin=TABLE_MARGIN):
+    height, width = page.shape[:2]
+    return np.ascontiguousarray(page[max(y1 - margin, 0):min(y2 + margin, height),
+                                     max(x1 - margin, 0):min(x2 + margin, width)])
+
+
+def record_llm_latency(images, seconds):
+    """
+    Adds an LLM call to the latency used for the time saved estimate.
+
+    :param images: Number of images sent in the call
+    :param seconds: Duration of the call
+    """
+    with _llm_latency_lock:
+        _llm_latency["images"] += images
+        _llm_latency["seconds"] += seconds
+
+
+def llm_seconds_per_image():
+    """
+    :return: Mean LLM time per image so far, or None before the first LLM call
+    """
+    if not _llm_latency["images"]:
+        return None
+    return _llm_latency["seconds"] / _llm_latency["images"]
+
+
+def read_page(page, read_words, threshold=CASCADE_THRESHOLD, checkpoint=lambda stage: None):
+    """
+    Reads the tables of a page with docTR and replaces the weak ones with what the LLM reads from their crops.
+    All crops of the page go to the LLM in one call. When docTR finds no table at all, the LLM reads the whole page,
+    as it would without the cascade.
+
+    Usage:
+    table_names, table_dfs, stats = read_page(page, lambda page: ocr_model([page]))
+
+    :param page: RGB page as a numpy array
+    :param read_words: Function returning the docTR word level result of a page
+    :param threshold: Lowest word confidence accepted from docTR
+    :param checkpoint: Called with the name of every stage before it starts, may raise to stop reading the page
+    :return: Table names, table dataframes and a dict of cascade statistics of the page
+    """
+    start = time.perf_counter()
+    checkpoint("ocr")
+    word_index = WordIndex.from_doctr_result(read_words(page))
+    checkpoint("tables")
+    table_dfs, confidence_dfs, table_boxes = table_extraction.get_indexed_tabular_content(page, word_index)
+    weak = [t for t, confidence_df in enumerate(confidence_dfs) if is_weak(confidence_df, threshold)]
+    doctr_seconds = time.perf_counter() - start
+
+    if table_dfs:
+        crops = [CropUpload(crop_table(page, *table_boxes[t]), f"table{t + 1}.png") for t in weak]
+    else:
+        crops = [CropUpload(page, "page.png")]
+
+    llm_tables = []
+    llm_seconds = 0.0
+    if crops:
+        checkpoint("llm")
+        llm_start = time.perf_counter()
+        results = msfocr.llm.ocr_functions.get_results(crops)
+        llm_tables = [msfocr.llm.ocr_functions.parse_table_data(result) for result in results]
+        llm_seconds = time.perf_counter() - llm_start
+        record_llm_latency(len(crops), llm_seconds)
+
+    checkpoint("merge")
+    if not table_dfs:
+        names, dfs = llm_tables[0]
+        table_names, merged_dfs = list(names), list(dfs)
+    else:
+        llm_tables = dict(zip(weak, llm_tables))
+        table_names, merged_dfs = [], []
+        for t, df in enumerate(table_dfs):
+            # Keep the docTR table when the LLM finds no table in the crop
+            if t in llm_tables and llm_tables[t][0]:
+                names, dfs = llm_tables[t]
+            else:
+                # Empty docTR cells are None, the LLM tables and the editor hold empty strings
+                names, dfs = [f"Table {t + 1}"], [df.fillna("")]
+            table_names.extend(names)
+            merged_dfs.extend(dfs)
+
+    stats = {
+        "escalated": bool(crops),
+        "tables": len(table_dfs),
+        "escalated_tables": len(weak),
+        "doctr_seconds": doctr_seconds,
+        "llm_seconds": llm_seconds,
+        "seconds": time.perf_counter() - start,
+    }
+    return table_names, merged_dfs, stats
+
+
+def summarize(page_stats):
+    """
+    Cascade statistics of an upload. Time is summed over pages, so it compares with reading the pages one by one
+    with the LLM however many pages ran in parallel.
+
+    :param page_stats: Statistics of every page, as returned by read_page
+    :return: Dict of cascade statistics
+    """
+    seconds = sum(stats["seconds"] for stats in page_stats)
+    per_image = llm_seconds_per_image()
+    return {
+        "pages": len(page_stats),
+        "escalated_pages": sum(stats["escalated"] for stats in page_stats),
+        "tables": sum(stats["tables"] for stats in page_stats),
+        "escalated_tables": sum(stats["escalated_tables"] for stats in page_stats),
+        "total_seconds": seconds,
+        "saved_seconds": per_image * len(page_stats) - seconds if per_image is not None else None,
+    }
+
+
+def format_stats(stats):
+    """
+    One line summary of the cascade statistics returned by summarize.
+    """
+    fraction = stats["escalated_pages"] / stats["pages"] if stats["pages"] else 0.0
+    summary = (f"{stats['escalated_pages']} of {stats['pages']} pages ({fraction:.0%}) sent to the LLM "
+               f"({stats['escalated_tables']} of {stats['tables']} tables), read in {stats['total_seconds']:.1f}s")
+    if stats["saved_seconds"] is not None:
+        summary += f", about {stats['saved_seconds']:.1f}s less than reading every page with the LLM"
+    return summary
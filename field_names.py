@@ -0,0 +1,51 @@
+"""
+Normalization of the row and column labels of recognized tables to known DHIS2 field names.
+"""
+import pandas as pd
+
+import msfocr.doctr.ocr_functions
+
+# Hardcoded fields of the vaccination tally sheet
+VACCINATION_DATA_ELEMENTS = ['', 'Paed (0-59m) vacc target population', 'BCG', 'HepB (birth dose, within 24h)',
+        'HepB (birth dose, 24h or later)',
+        'Polio (OPV) 0 (birth dose)', 'Polio (OPV) 1 (from 6 wks)', 'Polio (OPV) 2', 'Polio (OPV) 3',
+        'Polio (IPV)', 'DTP+Hib+HepB (pentavalent) 1', 'DTP+Hib+HepB (pentavalent) 2',
+        'DTP+Hib+HepB (pentavalent) 3', 'DTP, TD, Td or TT booster', 'Measles 0', 'Measles 1',
+        'Measles 2', 'MMR 0', 'MMR 1', 'MMR 2', 'PCV 1', 'PCV 2', 'PCV 3', 'PCV booster']
+VACCINATION_CATEGORY_OPTIONS = ['', '0-11m', '12-59m', '5-14y']
+
+
+def correct_field_names(dfs, dataElement_list, categoryOptionsList):
+    """
+    Corrects the text data in tables by replacing with closest match among the given fieldnames
+    :param dfs: Data as dataframes, empty cells as None or pd.NA (compact session tables)
+    :param dataElement_list: Names the first column (row labels) is matched against
+    :param categoryOptionsList: Names the first row (column labels) is matched against
+    :return Corrected data as dataframes
+    """
+    for table in dfs:
+        for row in range(table.shape[0]):
+            max_similarity_dataElement = 0
+            dataElement = ""
+            text = table.iloc[row,0]
+            if not pd.isna(text):
+                for name in dataElement_list:
+                    sim = msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
+                    if max_similarity_dataElement < sim:
+                        max_similarity_dataElement = sim
+                        dataElement = name
+                table.iloc[row,0] = dataElement
+
+    for table in dfs:
+        for id,col in enumerate(table.columns):
+            max_similarity_catOpt = 0
+            catOpt = ""
+            text = table.iloc[0,id]
+            if not pd.isna(text):
+                for name in categoryOptionsList:
+                    sim = msfocr.doctr.ocr_functions.letter_by_letter_similarity(text, name)
+                    if max_similarity_catOpt < sim:
+                        max_similarity_catOpt = sim
+                        catOpt = name
+                table.iloc[0,id] = catOpt
+    return dfs
@@ -0,0 +1,111 @@
+"""
+CPU inference settings for the docTR predictor: thread count, inference mode and an optional dynamically
+quantized int8 backend.
+
+The int8 backend is only used when `python -m benchmarks.quantization --write-gate` has compared it against fp32
+on the sample tally sheets and recorded that its character error rate is within the allowed limit.
+"""
+import json
+import os
+from pathlib import Path
+
+import torch
+
+import model_store
+
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "fp32")
+OCR_THREADS = int(os.environ.get("OCR_THREADS", "0"))
+BACKENDS = ("fp32", "int8")
+GATE_FILE = "quantization_gate.json"
+
+
+def configure_threads(num_threads=OCR_THREADS):
+    """
+    Sets the number of threads torch uses for CPU inference, 0 keeps torch's default of one per core.
+    """
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before any inter-op parallel work has started
+            pass
+
+
+def inference_mode():
+    """
+    Context manager that disables autograd tracking for everything run inside it.
+
+    Usage:
+    with inference.inference_mode():
+        result = ocr_model(doc)
+    """
+    return torch.inference_mode()
+
+
+def quantize_predictor(predictor):
+    """
+    Applies dynamic int8 quantization to the linear and recurrent layers of both docTR models in place.
+    Weights are stored as int8 and activations are quantized on the fly, which mostly speeds up the LSTM
+    decoder of crnn_vgg16_bn; the convolutions run in fp32.
+
+    :param predictor: docTR OCRPredictor
+    :return: The same predictor with quantized models
+    """
+    layers = {torch.nn.Linear, torch.nn.LSTM}
+    predictor.det_predictor.model = torch.ao.quantization.quantize_dynamic(
+        predictor.det_predictor.model, layers, dtype=torch.qint8)
+    predictor.reco_predictor.model = torch.ao.quantization.quantize_dynamic(
+        predictor.reco_predictor.model, layers, dtype=torch.qint8)
+    return predictor
+
+
+def model_versions(store_dir=model_store.MODEL_STORE_DIR):
+    archs = (model_store.DET_ARCH, model_store.RECO_ARCH)
+    return {arch: model_store.current_version(arch, store_dir) for arch in archs}
+
+
+def write_gate(report, store_dir=model_store.MODEL_STORE_DIR):
+    """
+    Records the outcome of the quantization benchmark next to the weights it was run with.
+
+    :param report: Dict with at least a boolean "passed"
+    :param store_dir: Root directory of the model store
+    """
+    gate = {**report, "models": model_versions(store_dir)}
+    (Path(store_dir) / GATE_FILE).write_text(json.dumps(gate, indent=2))
+
+
+def gate_passed(store_dir=model_store.MODEL_STORE_DIR):
+    """
+    Whether the int8 backend passed the accuracy benchmark for the model versions currently in the store.
+    """
+    gate_path = Path(store_dir) / GATE_FILE
+    if not gate_path.exists():
+        return False
+    gate = json.loads(gate_path.read_text())
+    return gate.get("passed", False) and gate.get("models") == model_versions(store_dir)
+
+
+def load_predictor(store_dir=model_store.MODEL_STORE_DIR, backend=OCR_BACKEND, **predictor_kwargs):
+    """
+    Loads the docTR predictor from the model store for the requested CPU backend.
+
+    Usage:
+    ocr_model = load_predictor(backend="int8")
+
+    :param store_dir: Root directory of the model store
+    :param backend: "fp32" or "int8", int8 falls back to fp32 unless it passed the accuracy gate
+    :param predictor_kwargs: Extra keyword arguments for doctr.models.ocr_predictor
+    :return: docTR OCRPredictor and the backend actually used
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{backend}', expected one of {BACKENDS}")
+    configure_threads()
+    predictor = model_store.load_ocr_predictor(store_dir, **predictor_kwargs)
+    if backend == "int8":
+        if gate_passed(store_dir):
+            return quantize_predictor(predictor), "int8"
+        print("int8 backend has not passed the accuracy gate for these weights, using fp32. "
+              "Run `python -m benchmarks.quantization --write-gate` to evaluate it.")
+    return predictor, "fp32"
@@ -0,0 +1,266 @@
+"""
+Shared OCR inference service. One process owns the docTR models and serves word-level OCR and table
+extraction over localhost HTTP to any number of app replicas, so scaling out does not multiply the model memory.
+Generic and template tables are assembled by the apps from the served word-level OCR, as locating their cells
+needs no models.
+
+Start the service next to the apps with `python inference_server.py`. The apps use it when it answers at
+OCR_SERVER_URL and otherwise load the models in-process.
+
+Pages are sent as .npy arrays, since the apps already hold them decoded.
+"""
+import argparse
+from collections import OrderedDict
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import resource
+import threading
+import time
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+import requests
+
+import inference
+import model_store
+import table_extraction
+import table_templates
+
+OCR_SERVER_URL = os.environ.get("OCR_SERVER_URL", "http://127.0.0.1:8601")
+HEALTH_TIMEOUT = 0.5
+# Seconds to wait for the service to answer a page before falling back to in-process inference
+REQUEST_TIMEOUT = float(os.environ.get("OCR_SERVER_TIMEOUT", "60"))
+HEALTH_CHECK_INTERVAL = 30
+RESULT_CACHE_SIZE = 4
+TABLE_MODES = ("recognition",)
+
+_health = {"checked": 0.0, "available": False}
+
+# Returned by try_remote when the caller has to fall back to in-process inference
+UNAVAILABLE = object()
+
+
+class RemoteDocument(SimpleNamespace):
+    """
+    docTR Document rebuilt from its JSON export, with the attributes the OCR helpers read (pages, blocks, lines,
+    words, value, confidence, geometry, dimensions).
+    """
+
+    def render(self, page_break="\n\n\n\n"):
+        return page_break.join(
+            "\n\n".join("\n".join(" ".join(word.value for word in line.words) for line in block.lines)
+                        for block in page.blocks)
+            for page in self.pages
+        )
+
+
+def _namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        converted = [_namespace(item) for item in value]
+        # Geometries and dimensions are tuples in docTR
+        return tuple(converted) if all(isinstance(item, (int, float, tuple)) for item in converted) else converted
+    return value
+
+
+def document_from_export(export):
+    return RemoteDocument(pages=_namespace(export["pages"]))
+
+
+def encode_page(page):
+    buffer = io.BytesIO()
+    np.save(buffer, page, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def decode_page(body):
+    return np.load(io.BytesIO(body), allow_pickle=False)
+
+
+def encode_tables(table_dfs, confidence_dfs):
+    return {"tables": [json.loads(df.to_json(orient="split")) for df in table_dfs],
+            "confidences": [json.loads(df.to_json(orient="split")) for df in confidence_dfs]}
+
+
+def decode_tables(payload):
+    to_df = lambda d: pd.DataFrame(d["data"], columns=d["columns"], index=d["index"])
+    return [to_df(d) for d in payload["tables"]], [to_df(d) for d in payload["confidences"]]
+
+
+# Client
+
+def available(server_url=OCR_SERVER_URL):
+    """
+    Whether the inference service answers, checked at most every HEALTH_CHECK_INTERVAL seconds.
+    """
+    now = time.monotonic()
+    if now - _health["checked"] > HEALTH_CHECK_INTERVAL:
+        try:
+            _health["available"] = requests.get(f"{server_url}/health", timeout=HEALTH_TIMEOUT).ok
+        except requests.RequestException:
+            _health["available"] = False
+        _health["checked"] = now
+    return _health["available"]
+
+
+def _post(path, page, server_url, **params):
+    try:
+        response = requests.post(f"{server_url}{path}", params=params, data=encode_page(page),
+                                 headers={"Content-Type": "application/octet-stream"},
+                                 timeout=(HEALTH_TIMEOUT, REQUEST_TIMEOUT))
+        response.raise_for_status()
+    except requests.RequestException:
+        # Timeouts included, fall back to in-process inference until the next health check
+        _health["available"] = False
+        raise
+    return response.json()
+
+
+def remote_ocr(page, server_url=OCR_SERVER_URL):
+    """
+    Word-level OCR of a page by the inference service.
+
+    :param page: RGB page as a numpy array
+    :return: RemoteDocument
+    """
+    return document_from_export(_post("/ocr", page, server_url))
+
+
+def remote_tables(page, mode, server_url=OCR_SERVER_URL):
+    """
+    Table extraction of a page by the inference service, for the modes that run models on the table cells.
+
+    :param page: RGB page as a numpy array
+    :param mode: "recognition", the cells of a registered layout or else of the tables found by img2table are
+                 recognized without running text detection
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    return decode_tables(_post("/tables", page, server_url, mode=mode))
+
+
+def try_remote(call, *args, **kwargs):
+    """
+    Runs a client call when the inference service is up.
+
+    Usage:
+    tables = try_remote(remote_tables, page, "recognition")
+    if tables is UNAVAILABLE:
+        tables = ...in-process inference...
+
+    :return: The result of the call, or UNAVAILABLE if the service is absent, timed out or the call failed
+    """
+    if not available():
+        return UNAVAILABLE
+    try:
+        return call(*args, **kwargs)
+    except requests.RequestException:
+        return UNAVAILABLE
+
+
+# Server
+
+class InferenceService:
+    """
+    Owns the models. Inference calls are serialized, torch already uses every core for a single call.
+
+    :param result_cache_size: Number of recent OCR results kept for repeated pages, 0 to always run inference
+    """
+
+    def __init__(self, result_cache_size=RESULT_CACHE_SIZE):
+        self.ocr_model, self.backend = inference.load_predictor(model_store.MODEL_STORE_DIR, inference.OCR_BACKEND,
+                                                                reco_bs=table_extraction.RECO_BATCH_SIZE)
+        self.templates = table_templates.load_templates()
+        self.lock = threading.Lock()
+        self.results = OrderedDict()
+        self.result_cache_size = result_cache_size
+        self.pages_served = 0
+
+    def ocr(self, page):
+        key = hashlib.sha1(page.tobytes()).hexdigest()
+        with self.lock:
+            self.pages_served += 1
+            if key in self.results:
+                return self.results[key]
+            with inference.inference_mode():
+                result = self.ocr_model([page])
+            if self.result_cache_size:
+                self.results[key] = result
+                if len(self.results) > self.result_cache_size:
+                    self.results.popitem(last=False)
+            return result
+
+    def tables(self, page, mode):
+        match = table_templates.match_template(page, self.templates)
+        with self.lock, inference.inference_mode():
+            if match is not None:
+                return table_templates.get_recognition_only_template_tabular_content(self.ocr_model, page, *match)
+            return table_extraction.get_recognition_only_tabular_content(self.ocr_model, page)
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            service = self.server.service
+            self.send_json({"status": "ok", "backend": service.backend, "pages_served": service.pages_served,
+                            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024})
+        else:
+            self.send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            try:
+                page = decode_page(body)
+            except (ValueError, EOFError) as e:
+                self.send_json({"error": f"page is not a .npy array: {e}"}, status=400)
+                return
+            if url.path == "/ocr":
+                self.send_json({"pages": self.server.service.ocr(page).export()["pages"]})
+            elif url.path == "/tables":
+                mode = parse_qs(url.query).get("mode", [None])[0]
+                if mode not in TABLE_MODES:
+                    self.send_json({"error": f"unknown mode {mode}"}, status=400)
+                    return
+                self.send_json(encode_tables(*self.server.service.tables(page, mode)))
+            else:
+                self.send_json({"error": "not found"}, status=404)
+        except Exception as e:
+            self.send_json({"error": str(e)}, status=500)
+
+
+def serve(host="127.0.0.1", port=8601, result_cache_size=RESULT_CACHE_SIZE):
+    server = ThreadingHTTPServer((host, port), InferenceHandler)
+    server.daemon_threads = True
+    server.service = InferenceService(result_cache_size)
+    print(f"Inference service ({server.service.backend}) listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared OCR inference service for the Streamlit apps.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(urlparse(OCR_SERVER_URL).port or 8601))
+    parser.add_argument("--result-cache-size", type=int, default=RESULT_CACHE_SIZE,
+                        help="Recent OCR results kept for repeated pages, 0 to disable")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.result_cache_size)
@@ -0,0 +1,32 @@
+"""
+Streamlit script run by AppTest for each simulated session. AppTest cannot upload files, so the file uploader
+is replaced by one that returns the images listed in session state, then the app under test is executed.
+"""
+from pathlib import Path
+import runpy
+import sys
+
+import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
+from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg"}
+
+
+def file_uploader(*args, **kwargs):
+    uploads = []
+    for i, (path, data) in enumerate(st.session_state.get("loadtest_uploads", [])):
+        record = UploadedFileRec(file_id=f"{st.session_state.get('loadtest_session')}-{i}", name=Path(path).name,
+                                 type=MIME_TYPES.get(Path(path).suffix.lower(), "image/jpeg"), data=data)
+        uploads.append(UploadedFile(record, None))
+    return uploads
+
+
+DeltaGenerator.file_uploader = lambda self, *args, **kwargs: file_uploader(*args, **kwargs)
+st.file_uploader = file_uploader
+
+runpy.run_path(str(ROOT / st.session_state["loadtest_app"]), run_name="__main__")
@@ -0,0 +1,180 @@
+"""
+Load test that drives simulated clerk sessions through app_llm.py or app_doctr.py with Streamlit's AppTest,
+against local DHIS2 and OpenAI stand-ins, and reports throughput, latency percentiles and peak RSS.
+
+Each session uploads the given images, selects an organisation unit and data set, edits a cell, confirms the
+pages and submits. AppTest drives its script through a process-wide Streamlit runtime, so every session runs in a
+process of its own. Caches such as the loaded models are therefore not shared between sessions as they would be in
+one Streamlit container, and peak RSS is reported per session process and summed over the concurrent ones.
+
+Usage (from the repository root):
+python -m loadtest.run --app app_llm.py --sessions 16 --concurrency 8 --llm-latency 3 sheets/*.jpg
+"""
+import argparse
+import math
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import time
+import traceback
+
+from streamlit.testing.v1 import AppTest
+
+from loadtest.stubs import DHIS2Handler, OpenAIHandler, start_stub, stub_url
+
+DRIVER = str(Path(__file__).resolve().parent / "app_driver.py")
+PAGE_REVIEWED_INDICATOR = "✓"
+ORG_UNIT_SEARCH = "Stub"
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def widget(at, kind, label):
+    """
+    Finds a widget of the app by its type and label, e.g. widget(at, "selectbox", "Data Set").
+    """
+    for w in getattr(at, kind):
+        if w.label == label:
+            return w
+    raise LookupError(f"No {kind} labelled '{label}' on the page")
+
+
+class Session:
+    """
+    One simulated clerk. Every interaction is a script run, and the latency of each run is recorded.
+    """
+
+    def __init__(self, session_id, app, uploads, timeout):
+        self.at = AppTest.from_file(DRIVER, default_timeout=timeout)
+        self.app = app
+        self.step_latencies = []
+        state = self.at.session_state
+        state["loadtest_app"] = app
+        state["loadtest_session"] = session_id
+        # Distinct bytes per session so sessions do not share st.cache_data entries for their uploads
+        state["loadtest_uploads"] = [(path, data + f"loadtest-{session_id}".encode()) for path, data in uploads]
+        state["initialised"] = True
+        state["upload_key"] = 1000
+        state["password_correct"] = True
+
+    def step(self, action=None):
+        if action is not None:
+            action()
+        start = time.perf_counter()
+        self.at.run()
+        self.step_latencies.append(time.perf_counter() - start)
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def edit_first_table(self):
+        dfs = list(self.at.session_state["table_dfs"])
+        if dfs and dfs[0].shape[0] > 1 and dfs[0].shape[1] > 1:
+            df = dfs[0].copy()
+            df.iloc[1, 1] = "1"
+            dfs[0] = df
+            self.at.session_state["table_dfs"] = dfs
+
+    def run(self):
+        self.step()
+        self.step(lambda: widget(self.at, "text_input", "Organisation Unit").set_value(ORG_UNIT_SEARCH))
+        self.step(lambda: widget(self.at, "selectbox", "Organisation Results").select_index(0))
+        children_label = "Tally Sheet Type" if self.app == "app_llm.py" else "Organisation Children"
+        self.step(lambda: widget(self.at, "selectbox", children_label).select_index(0))
+        self.step(lambda: widget(self.at, "selectbox", "Data Set").select_index(0))
+        self.edit_first_table()
+
+        if self.app == "app_llm.py":
+            pages = widget(self.at, "selectbox", "Page Number").options
+            for _ in range(len(pages)):
+                pending = [p for p in widget(self.at, "selectbox", "Page Number").options
+                           if PAGE_REVIEWED_INDICATOR not in p]
+                if not pending:
+                    break
+                self.step(lambda: widget(self.at, "selectbox", "Page Number").set_value(pending[0]))
+                self.step(lambda: widget(self.at, "button", "Confirm data").click())
+        else:
+            self.step(lambda: widget(self.at, "button", "Generate Key-Value Pairs").click())
+        self.step(lambda: widget(self.at, "button", "Upload to DHIS2").click())
+
+
+def run_session(session_id, app, uploads, timeout):
+    """
+    Runs one simulated session, in a worker process of its own.
+
+    :return: Session latency, latencies of its script runs, error message or None, and peak RSS of the process in MB
+    """
+    session = Session(session_id, app, uploads, timeout)
+    start = time.perf_counter()
+    error = None
+    try:
+        session.run()
+    except Exception:
+        error = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    latency = time.perf_counter() - start
+    return latency, session.step_latencies, error, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="+", help="Tally sheet images uploaded by every session")
+    parser.add_argument("--app", default="app_llm.py", choices=["app_llm.py", "app_doctr.py"])
+    parser.add_argument("--sessions", type=int, default=8, help="Total number of sessions")
+    parser.add_argument("--concurrency", type=int, default=None, help="Sessions running at once")
+    parser.add_argument("--dhis2-latency", type=float, default=0.1, help="Seconds per DHIS2 response")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="Seconds per OpenAI response")
+    parser.add_argument("--llm-response", default=None, help="File with the message content the LLM returns")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds allowed per script run")
+    args = parser.parse_args()
+
+    llm_kwargs = {"llm_content": Path(args.llm_response).read_text()} if args.llm_response else {}
+    dhis2 = start_stub(DHIS2Handler, latency=args.dhis2_latency)
+    openai = start_stub(OpenAIHandler, latency=args.llm_latency, **llm_kwargs)
+    os.environ.update({
+        "DHIS2_USERNAME": "loadtest",
+        "DHIS2_PASSWORD": "loadtest",
+        "DHIS2_SERVER_URL": stub_url(dhis2),
+        "OPENAI_API_KEY": "loadtest",
+        "OPENAI_BASE_URL": stub_url(openai) + "/v1",
+    })
+
+    uploads = [(path, Path(path).read_bytes()) for path in args.images]
+    concurrency = min(args.concurrency or args.sessions, args.sessions)
+    start = time.perf_counter()
+    # A fresh spawned process per session, the stand-ins keep running in this one
+    with multiprocessing.get_context("spawn").Pool(concurrency, maxtasksperchild=1) as pool:
+        outcomes = pool.starmap(run_session, [(i, args.app, uploads, args.timeout) for i in range(args.sessions)])
+    elapsed = time.perf_counter() - start
+
+    session_latencies = [latency for latency, _, error, _ in outcomes if error is None]
+    step_latencies = [step for _, steps, _, _ in outcomes for step in steps]
+    errors = [error for _, _, error, _ in outcomes if error is not None]
+    session_rss_mb = sorted((rss for *_, rss in outcomes), reverse=True)
+    harness_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"App: {args.app}, sessions: {args.sessions}, concurrency: {concurrency}")
+    print(f"Completed: {len(session_latencies)}, failed: {len(errors)}, wall time: {elapsed:.1f}s")
+    print(f"Throughput: {len(session_latencies) / elapsed:.3f} sessions/s")
+    print(f"Session latency p50: {percentile(session_latencies, 50):.2f}s, "
+          f"p95: {percentile(session_latencies, 95):.2f}s")
+    print(f"Interaction latency p50: {percentile(step_latencies, 50):.2f}s, "
+          f"p95: {percentile(step_latencies, 95):.2f}s")
+    print(f"Peak RSS per session process: max {session_rss_mb[0]:.0f} MB, "
+          f"mean {sum(session_rss_mb) / len(session_rss_mb):.0f} MB")
+    print(f"Peak RSS of {concurrency} concurrent sessions: at most {sum(session_rss_mb[:concurrency]):.0f} MB, "
+          f"plus {harness_rss_mb:.0f} MB for the harness and stand-ins")
+    print(f"Stub requests: DHIS2 {dhis2.requests}, OpenAI {openai.requests}")
+    for error in sorted(set(errors)):
+        print(f"Error ({errors.count(error)} sessions): {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Local stand-ins for the DHIS2 Web API and the OpenAI chat completions API, with configurable latency.
+
+Usage:
+dhis2 = start_stub(DHIS2Handler, latency=0.2)
+openai = start_stub(OpenAIHandler, latency=2.0)
+os.environ["DHIS2_SERVER_URL"] = stub_url(dhis2)
+os.environ["OPENAI_BASE_URL"] = stub_url(openai) + "/v1"
+"""
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+ORG_UNIT = {"id": "StubOrgUnit", "name": "Stub Hospital", "displayName": "Stub Hospital"}
+DATA_SET = {
+    "id": "StubDataSet",
+    "name": "Stub Vaccination",
+    "displayName": "Stub Vaccination",
+    "periodType": "Weekly",
+    "dataSetElements": [],
+    "categoryCombo": {"id": "StubCatCombo", "categoryOptionCombos": []},
+}
+CHILD_ORG_UNIT = {
+    "id": "StubChildOrgUnit",
+    "name": "Stub Ward",
+    "displayName": "Stub Ward",
+    "dataSets": [{"id": DATA_SET["id"]}],
+}
+DEFAULT_LLM_CONTENT = json.dumps({"tables": [{"table_name": "Stub Table", "headers": ["", "0-11m", "12-59m"],
+                                              "data": [["BCG", "1", "2"], ["Measles 1", "3", "4"]]}]})
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Base handler that waits `server.latency` seconds before every response and counts requests and bytes.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes_received += len(body)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return body
+
+    def send_json(self, payload, status=200):
+        time.sleep(self.server.latency)
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DHIS2Handler(StubHandler):
+    """
+    Mimics the DHIS2 endpoints used by msfocr.data.dhis2: metadata lookups and data value set imports. Imported
+    data value sets are kept in `server.data_value_sets`, and values of the data elements in
+    `server.conflicting_elements` are ignored with a conflict, as DHIS2 does for elements outside the data set.
+    """
+
+    def do_GET(self):
+        self.read_body()
+        path = urlparse(self.path).path.rstrip("/")
+        if path.startswith("/api/organisationUnits/"):
+            self.send_json({**ORG_UNIT, "children": [CHILD_ORG_UNIT]})
+        elif path == "/api/organisationUnits":
+            self.send_json({"organisationUnits": [ORG_UNIT]})
+        elif path.startswith("/api/dataSets/"):
+            self.send_json(DATA_SET)
+        elif path == "/api/dataSets":
+            self.send_json({"dataSets": [DATA_SET]})
+        elif path.startswith("/api/dataElements") or path.startswith("/api/categoryOptionCombos"):
+            self.send_json({"dataElements": [], "categoryOptionCombos": []})
+        else:
+            self.send_json({})
+
+    def do_POST(self):
+        payload = json.loads(self.read_body() or b"{}")
+        if urlparse(self.path).path.rstrip("/") == "/api/dataValueSets":
+            data_values = payload.get("dataValues", [])
+            conflicts = [{"object": data_value["dataElement"], "value": "Data element is not part of the data set"}
+                         for data_value in data_values
+                         if data_value.get("dataElement") in self.server.conflicting_elements]
+            with self.server.lock:
+                self.server.data_value_sets.append(payload)
+            self.send_json({
+                "status": "WARNING" if conflicts else "SUCCESS",
+                "importCount": {"imported": len(data_values) - len(conflicts), "updated": 0, "ignored": len(conflicts)},
+                "conflicts": conflicts,
+            })
+        else:
+            self.send_json({}, status=404)
+
+
+class OpenAIHandler(StubHandler):
+    """
+    Mimics POST /v1/chat/completions, answering every request with `server.llm_content`.
+    """
+
+    def do_POST(self):
+        request = json.loads(self.read_body() or b"{}")
+        content = self.server.llm_content
+        self.send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": self.server.prompt_tokens, "completion_tokens": len(content) // 4,
+                      "total_tokens": self.server.prompt_tokens + len(content) // 4},
+        })
+
+
+def start_stub(handler, latency=0.0, port=0, llm_content=DEFAULT_LLM_CONTENT, prompt_tokens=1000,
+               conflicting_elements=()):
+    """
+    Starts a stub server in a daemon thread.
+
+    :param handler: DHIS2Handler or OpenAIHandler
+    :param latency: Seconds to wait before every response
+    :param port: Port to listen on, 0 picks a free port
+    :param llm_content: Message content returned by the OpenAI stub
+    :param prompt_tokens: Prompt token count reported by the OpenAI stub
+    :param conflicting_elements: Data element ids the DHIS2 stub ignores with a conflict
+    :return: The running ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.llm_content = llm_content
+    server.prompt_tokens = prompt_tokens
+    server.conflicting_elements = set(conflicting_elements)
+    server.data_value_sets = []
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.bytes_received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
@@ -0,0 +1,192 @@
+"""
+Local, versioned store for the docTR model weights used by the Streamlit apps.
+
+Weights are written once (at image build time) and then loaded from disk with no network access:
+
+    models/
+        db_resnet50/
+            current                 <- name of the version directory to load
+            0.8.1/
+                weights.pt          <- torch state_dict
+                manifest.json       <- arch, version, sha256 and size of weights.pt
+        crnn_vgg16_bn/
+            ...
+
+Populate the store with `python model_store.py`, which downloads the pretrained docTR weights a single time.
+"""
+import argparse
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+
+DET_ARCH = "db_resnet50"
+RECO_ARCH = "crnn_vgg16_bn"
+MODEL_STORE_DIR = os.environ.get("MODEL_STORE_DIR", "models")
+WEIGHTS_FILE = "weights.pt"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "current"
+
+
+def sha256sum(path, chunk_size=1 << 20):
+    """
+    Computes the SHA-256 checksum of a file without reading it into memory at once.
+
+    :param path: Path to the file
+    :param chunk_size: Number of bytes read at a time
+    :return: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def current_version(arch, store_dir=MODEL_STORE_DIR):
+    """
+    Returns the version of an architecture that should be loaded, pinned with the OCR_MODEL_VERSION
+    environment variable or taken from the `current` file of the store.
+
+    :param arch: docTR architecture name, e.g. "db_resnet50"
+    :param store_dir: Root directory of the model store
+    :return: Version directory name
+    """
+    pinned = os.environ.get("OCR_MODEL_VERSION")
+    if pinned:
+        return pinned
+    current_path = Path(store_dir) / arch / CURRENT_FILE
+    if not current_path.exists():
+        raise FileNotFoundError(
+            f"No weights for {arch} in model store '{store_dir}'. Run `python model_store.py` to populate it."
+        )
+    return current_path.read_text().strip()
+
+
+def save_weights(arch, model, version, store_dir=MODEL_STORE_DIR):
+    """
+    Saves the weights of a model into a new version directory of the store and marks it as current.
+
+    :param arch: docTR architecture name
+    :param model: torch model whose state_dict is saved
+    :param version: Name of the version directory
+    :param store_dir: Root directory of the model store
+    :return: Path to the version directory
+    """
+    import torch
+
+    version_dir = Path(store_dir) / arch / version
+    version_dir.mkdir(parents=True, exist_ok=True)
+    weights_path = version_dir / WEIGHTS_FILE
+    torch.save(model.state_dict(), weights_path)
+    manifest = {
+        "arch": arch,
+        "version": version,
+        "file": WEIGHTS_FILE,
+        "sha256": sha256sum(weights_path),
+        "size": weights_path.stat().st_size,
+        "created": datetime.now(timezone.utc).isoformat(),
+    }
+    (version_dir / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+    (Path(store_dir) / arch / CURRENT_FILE).write_text(version)
+    return version_dir
+
+
+def verify_weights(arch, store_dir=MODEL_STORE_DIR, version=None):
+    """
+    Checks the weights of an architecture against the checksum recorded in the manifest. This reads the whole
+    file, so it runs when the store is populated or checked rather than on every start.
+
+    :param arch: docTR architecture name
+    :param store_dir: Root directory of the model store
+    :param version: Version directory to check, defaults to the current version
+    """
+    version = version or current_version(arch, store_dir)
+    version_dir = Path(store_dir) / arch / version
+    manifest = json.loads((version_dir / MANIFEST_FILE).read_text())
+    weights_path = version_dir / manifest["file"]
+    if sha256sum(weights_path) != manifest["sha256"]:
+        raise ValueError(f"Checksum mismatch for {weights_path}, the model store is corrupted.")
+
+
+def load_weights(arch, store_dir=MODEL_STORE_DIR, version=None):
+    """
+    Loads a state_dict from the store. The file is memory-mapped so the weights are paged in from disk
+    instead of being copied into memory before they are assigned to the model. Only the file size is checked
+    against the manifest here, the checksum is verified by `python model_store.py` (see verify_weights).
+
+    :param arch: docTR architecture name
+    :param store_dir: Root directory of the model store
+    :param version: Version directory to load, defaults to the current version
+    :return: state_dict for the architecture
+    """
+    import torch
+
+    version = version or current_version(arch, store_dir)
+    version_dir = Path(store_dir) / arch / version
+    manifest = json.loads((version_dir / MANIFEST_FILE).read_text())
+    weights_path = version_dir / manifest["file"]
+    if weights_path.stat().st_size != manifest["size"]:
+        raise ValueError(f"Size mismatch for {weights_path}, the model store is corrupted.")
+    try:
+        return torch.load(weights_path, map_location="cpu", mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 has no memory-mapped loading
+        return torch.load(weights_path, map_location="cpu")
+
+
+def load_ocr_predictor(store_dir=MODEL_STORE_DIR, version=None, **predictor_kwargs):
+    """
+    Builds the docTR ocr_predictor from weights in the store, without downloading anything.
+
+    Usage:
+    ocr_model = load_ocr_predictor("models")
+
+    :param store_dir: Root directory of the model store
+    :param version: Version directory of both models, defaults to the current version of each
+    :param predictor_kwargs: Extra keyword arguments for doctr.models.ocr_predictor
+    :return: docTR OCRPredictor
+    """
+    from doctr.models import crnn_vgg16_bn, db_resnet50, ocr_predictor
+
+    det_model = db_resnet50(pretrained=False, pretrained_backbone=False)
+    det_model.load_state_dict(load_weights(DET_ARCH, store_dir, version))
+    reco_model = crnn_vgg16_bn(pretrained=False, pretrained_backbone=False)
+    reco_model.load_state_dict(load_weights(RECO_ARCH, store_dir, version))
+    return ocr_predictor(det_arch=det_model, reco_arch=reco_model, pretrained=False, **predictor_kwargs)
+
+
+def populate_store(store_dir=MODEL_STORE_DIR, version=None):
+    """
+    Downloads the pretrained docTR weights once and writes them into the store.
+
+    :param store_dir: Root directory of the model store
+    :param version: Name of the version directory, defaults to the installed docTR version
+    """
+    import doctr
+    from doctr.models import crnn_vgg16_bn, db_resnet50
+
+    version = version or doctr.__version__
+    for arch, builder in [(DET_ARCH, db_resnet50), (RECO_ARCH, crnn_vgg16_bn)]:
+        version_dir = save_weights(arch, builder(pretrained=True), version, store_dir)
+        print(f"Saved {arch} weights to {version_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Populate the local docTR model store.")
+    parser.add_argument("--store", default=MODEL_STORE_DIR, help="Root directory of the model store")
+    parser.add_argument("--version", default=None, help="Version directory name (defaults to the docTR version)")
+    parser.add_argument("--check", action="store_true",
+                        help="Only verify the checksums and time loading the predictor from the store")
+    args = parser.parse_args()
+
+    if not args.check:
+        populate_store(args.store, args.version)
+    for arch in (DET_ARCH, RECO_ARCH):
+        verify_weights(arch, args.store, args.version)
+    print(f"Checksums of {args.store} verified")
+    start = time.perf_counter()
+    load_ocr_predictor(args.store, args.version)
+    print(f"Loaded OCR predictor from {args.store} in {time.perf_counter() - start:.2f}s")
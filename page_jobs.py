@@ -0,0 +1,162 @@
+"""
+Page jobs that can be cancelled. The recognition of every uploaded page runs as a job on a worker pool owned by the
+cancellation token of the session and upload it belongs to. Every session reads its pages in parallel, mostly
+waiting on the LLM, without queueing behind the pages of other sessions. When the session clears the form or uploads
+other files the token is cancelled: jobs still waiting in the pool are dropped, and running jobs stop at their next
+stage boundary, so no more CPU or LLM requests are spent on pages nobody will read.
+
+Usage:
+token = CancellationToken(session_id, upload_key)
+future = submit(token, page_number, read_page, lambda: (upload,))   # read_page(upload, checkpoint=...)
+token.cancel()
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+# Pages of one upload read at the same time
+PAGE_WORKERS = int(os.environ.get("PAGE_WORKERS", "4"))
+# Seconds between checks of the jobs an app script run is waiting for
+POLL_INTERVAL = 0.2
+
+_lock = threading.Lock()
+
+# Work given back by cancelled jobs since the process started
+metrics = {
+    "jobs_started": 0,
+    "jobs_completed": 0,
+    "jobs_dropped": 0,
+    "jobs_stopped": 0,
+    "llm_answers_discarded": 0,
+    "seconds_reclaimed": 0.0,
+}
+# Duration of completed jobs of every kind, to estimate how long cancelled jobs would have run
+_durations = {}
+
+
+class Cancelled(Exception):
+    """
+    Raised at a stage boundary of a job whose upload was cancelled.
+    """
+
+
+class CancellationToken:
+    """
+    Cancellation state and worker pool of the page jobs of one upload in one session.
+
+    :param session_id: Streamlit session the upload belongs to, for the logs
+    :param upload_key: Identifies the upload, a new key means the previous jobs are no longer needed
+    """
+
+    def __init__(self, session_id, upload_key):
+        self.session_id = session_id
+        self.upload_key = upload_key
+        self.jobs = {}
+        self.executor = ThreadPoolExecutor(PAGE_WORKERS, thread_name_prefix="page-job")
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Drops the jobs that have not started and makes the running ones stop at their next stage boundary.
+        """
+        if self.cancelled:
+            return
+        self._cancelled.set()
+        dropped = stopping = 0
+        with _lock:
+            for job in self.jobs.values():
+                if job.future.cancel():
+                    dropped += 1
+                    metrics["jobs_dropped"] += 1
+                    metrics["seconds_reclaimed"] += expected_seconds(job.kind)
+                elif not job.future.done():
+                    stopping += 1
+                    # The request cannot be taken back from the LLM client, its answer is thrown away instead
+                    if job.stage == "llm":
+                        metrics["llm_answers_discarded"] += 1
+        # The workers exit once the running jobs reach their next stage boundary
+        self.executor.shutdown(wait=False)
+        print(f"Cancelled the page jobs of session {self.session_id} upload {self.upload_key}: {dropped} dropped, "
+              f"{stopping} stopping. {format_metrics()}")
+
+
+class PageJob:
+    def __init__(self, token, kind):
+        self.token = token
+        self.kind = kind
+        self.stage = None
+        self.future = None
+
+    def checkpoint(self, stage):
+        """
+        Called by the job before each of its stages.
+
+        :param stage: Name of the stage about to start, "llm" for stages waiting on the LLM
+        :raises Cancelled: When the upload of the job was cancelled
+        """
+        if self.token.cancelled:
+            raise Cancelled(stage)
+        self.stage = stage
+
+
+def expected_seconds(kind):
+    """
+    Mean duration of the completed jobs of a kind, 0 when none has completed yet. Call with _lock held.
+    """
+    count, seconds = _durations.get(kind, (0, 0.0))
+    return seconds / count if count else 0.0
+
+
+def _run(job, function, *args):
+    start = time.perf_counter()
+    try:
+        job.checkpoint("start")
+        result = function(*args, checkpoint=job.checkpoint)
+    except Cancelled:
+        with _lock:
+            metrics["jobs_stopped"] += 1
+            metrics["seconds_reclaimed"] += max(expected_seconds(job.kind) - (time.perf_counter() - start), 0.0)
+        raise
+    with _lock:
+        count, seconds = _durations.get(job.kind, (0, 0.0))
+        _durations[job.kind] = (count + 1, seconds + time.perf_counter() - start)
+        metrics["jobs_completed"] += 1
+    return result
+
+
+def submit(token, key, function, make_args):
+    """
+    Runs function(*make_args(), checkpoint=...) on the worker pool of the token, unless the token already has a job
+    under this key, so script reruns wait for the jobs they started before instead of starting them again.
+
+    :param token: CancellationToken of the upload
+    :param key: Identifies the job within the upload, e.g. the page number
+    :param function: Job function, it calls checkpoint(stage) before each stage
+    :param make_args: Returns the tuple of arguments of the job, only called when a job is started
+    :return: Future of the job result, which raises Cancelled if the job was stopped
+    :raises Cancelled: When the token was already cancelled
+    """
+    if token.cancelled:
+        raise Cancelled("submit")
+    job = token.jobs.get(key)
+    # A job that failed is started again, as an uncached call would be
+    if job is None or (job.future.done() and not job.future.cancelled() and job.future.exception() is not None):
+        job = PageJob(token, function.__name__)
+        job.future = token.executor.submit(_run, job, function, *make_args())
+        token.jobs[key] = job
+        with _lock:
+            metrics["jobs_started"] += 1
+    return job.future
+
+
+def format_metrics():
+    with _lock:
+        return (f"Reclaimed about {metrics['seconds_reclaimed']:.1f}s of page work so far: "
+                f"{metrics['jobs_dropped']} jobs dropped before starting, {metrics['jobs_stopped']} stopped at a "
+                f"stage boundary, {metrics['llm_answers_discarded']} LLM answers discarded "
+                f"({metrics['jobs_completed']} of {metrics['jobs_started']} jobs completed)")
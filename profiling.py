@@ -0,0 +1,174 @@
+"""
+Opt-in profiling of a single Streamlit script run, downloadable from the page for offline analysis.
+
+Profiling is only available when the server is started with ALLOW_PROFILING=true, and is then turned on for a
+session by opening the app with the `?profile=1` URL parameter. Each run captures a cProfile of the script thread,
+and of the page jobs it starts on other threads (see profile_job), and tracemalloc allocation statistics.
+
+Usage, at the top and at the very end of an app script:
+profiling.start_run_profile()
+...
+profiling.finish_run_profile()
+"""
+import cProfile
+from datetime import datetime
+import functools
+import io
+import marshal
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import weakref
+
+import streamlit as st
+
+ALLOW_PROFILING = os.environ.get("ALLOW_PROFILING", "false").lower() == "true"
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+# tracemalloc is process-wide, so it runs while at least one session is profiling
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0:
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+    _release_tracemalloc()
+    return snapshot, peak
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class RunCapture:
+    """
+    Profile of one script run while it is being captured. A capture that is never finished, because its session
+    closed in the middle of the run, stops using tracemalloc when the session state holding it is dropped.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.start = time.perf_counter()
+        self.started_at = datetime.now()
+        self.job_profilers = []
+        _start_tracemalloc()
+        self._release = weakref.finalize(self, _release_tracemalloc)
+
+    def finish(self):
+        """
+        :return: Snapshot and peak size of the traced memory
+        """
+        self.profiler.disable()
+        self._release.detach()
+        return _stop_tracemalloc()
+
+
+def profiling_requested():
+    return ALLOW_PROFILING and st.query_params.get("profile") == "1"
+
+
+def start_run_profile():
+    """
+    Starts profiling the current script run if profiling was requested. A capture left running by a run that
+    was interrupted by st.rerun is finished first, so it can still be downloaded.
+    """
+    if "_run_profile" in st.session_state:
+        _finish_capture()
+    if not profiling_requested():
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ allows one active cProfile per process, this run is then not captured
+        print("Not profiling this script run, another profile is already running")
+        return
+    st.session_state["_run_profile"] = RunCapture(profiler)
+
+
+def profile_job(function):
+    """
+    Wraps a function that the current script run hands to another thread, e.g. a page job, so its profile is added
+    to the capture of the run. Jobs that finish after the run ended, e.g. because it was interrupted by a rerun,
+    are not included.
+
+    Usage:
+    page_jobs.submit(token, page_number, profiling.profile_job(read_page), lambda: (upload,))
+    """
+    if "_run_profile" not in st.session_state:
+        return function
+    job_profilers = st.session_state["_run_profile"].job_profilers
+
+    @functools.wraps(function)
+    def profiled(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active cProfile per process, the job then runs unprofiled
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            job_profilers.append(profiler)
+
+    return profiled
+
+
+def _finish_capture():
+    capture = st.session_state.pop("_run_profile")
+    snapshot, peak = capture.finish()
+    elapsed = time.perf_counter() - capture.start
+    profiler, started_at, job_profilers = capture.profiler, capture.started_at, capture.job_profilers
+
+    summary = io.StringIO()
+    summary.write(f"Script run started {started_at:%Y-%m-%d %H:%M:%S}, {elapsed:.2f}s wall time, "
+                  f"{peak / 2**20:.1f} MiB peak traced memory, {len(job_profilers)} jobs on other threads\n\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    if job_profilers:
+        stats.add(*job_profilers)
+    stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+    summary.write(f"Top {TOP_ALLOCATIONS} allocation sites still alive at the end of the run\n")
+    for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+        summary.write(f"{stat}\n")
+
+    st.session_state["profile_capture"] = {
+        "name": f"profile-{started_at:%Y%m%d-%H%M%S}",
+        "prof": marshal.dumps(stats.stats),
+        "summary": summary.getvalue(),
+    }
+
+
+def finish_run_profile():
+    """
+    Finishes the capture of the current script run and offers the latest capture for download in the sidebar.
+    """
+    if "_run_profile" in st.session_state:
+        _finish_capture()
+    capture = st.session_state.get("profile_capture")
+    if capture is None or not profiling_requested():
+        return
+    with st.sidebar:
+        st.write("### Profiling ###")
+        st.download_button("Download profile (.prof)", data=capture["prof"], file_name=f"{capture['name']}.prof",
+                           mime="application/octet-stream")
+        st.download_button("Download profile summary (.txt)", data=capture["summary"],
+                           file_name=f"{capture['name']}.txt", mime="text/plain")
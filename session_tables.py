@@ -0,0 +1,59 @@
+"""
+Compact representation of the recognized tables kept in Streamlit session state.
+
+Tables are stored with Arrow-backed string columns instead of object columns of Python strings, which keeps
+each session's copy of every page small. Pandas copy-on-write is enabled by the apps, so copies of the stored
+tables share their buffers until one of them is modified.
+"""
+COMPACT_DTYPE = "string[pyarrow]"
+
+
+def compact_table(df):
+    """
+    Converts a table to Arrow-backed string columns.
+
+    Usage:
+    st.session_state.table_dfs = [compact_table(df) for df in table_dfs]
+
+    :param df: Table dataframe with object, string or numeric cells
+    :return: Dataframe whose columns are all Arrow-backed strings, missing cells as pd.NA
+    """
+    if (df.dtypes == COMPACT_DTYPE).all():
+        return df
+    return df.astype(object).where(df.notna(), None).astype(COMPACT_DTYPE)
+
+
+def compact_tables(dfs):
+    return [compact_table(df) for df in dfs]
+
+
+def expand_table(df):
+    """
+    Converts a compact table back to object columns of Python strings with None for empty cells, the form the
+    msfocr key-value helpers expect. The result is a new dataframe, so the stored table is left untouched.
+
+    :param df: Compact table dataframe
+    :return: Dataframe with object columns
+    """
+    return df.astype(object).where(df.notna(), None)
+
+
+def tables_equal(df, compact_df):
+    """
+    Compares a table returned by the editor with a stored compact table, ignoring the difference in dtypes.
+
+    :param df: Table dataframe in any representation
+    :param compact_df: Compact table dataframe
+    :return: True if both tables hold the same cells and column labels
+    """
+    return compact_table(df).equals(compact_df)
+
+
+def tables_memory_usage(dfs):
+    """
+    Total memory used by a list of tables, including the Python string objects in object columns.
+
+    :param dfs: List of dataframes
+    :return: Size in bytes
+    """
+    return int(sum(df.memory_usage(deep=True).sum() for df in dfs))
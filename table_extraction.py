@@ -0,0 +1,171 @@
+"""
+Table extraction helpers built on img2table's cell geometry.
+"""
+from functools import cached_property
+
+import cv2
+from img2table.document import Image
+import pandas as pd
+
+CELL_MARGIN = 3
+RECO_BATCH_SIZE = 256
+# Headers lower than this are not worth a separate OCR pass, the whole page is read instead
+MIN_HEADER_HEIGHT = 64
+
+
+class ArrayImage(Image):
+    """
+    img2table Image backed by a page that is already decoded, so img2table reads the shared RGB array instead of
+    decoding the uploaded file again. img2table works on one channel, like its own Image decoding with
+    IMREAD_GRAYSCALE, so it gets a grayscale copy; the RGB page stays the one used by docTR and for cell crops.
+
+    Usage:
+    tables = ArrayImage(page).extract_tables()
+    """
+
+    def __init__(self, array):
+        super().__init__(src=b"")
+        self.array = array
+
+    @cached_property
+    def images(self):
+        return [cv2.cvtColor(self.array, cv2.COLOR_RGB2GRAY)]
+
+
+def recognize_cell_crops(ocr_model, tables):
+    """
+    Recognizes the cell crops of several tables in as few recognition batches as possible.
+
+    :param ocr_model: docTR OCRPredictor, only its recognition predictor is used
+    :param tables: List of tables, each a list of rows of cell crops as numpy arrays
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    crops = [crop for table in tables for row in table for crop in row if crop.size]
+    predictions = iter(ocr_model.reco_predictor(crops)) if crops else iter([])
+
+    table_dfs, confidence_dfs = [], []
+    for table in tables:
+        values, confidences = [], []
+        for row in table:
+            row_predictions = [next(predictions) if crop.size else ("", None) for crop in row]
+            values.append([text if text else None for text, _ in row_predictions])
+            confidences.append([confidence if text else None for text, confidence in row_predictions])
+        table_dfs.append(pd.DataFrame(values))
+        confidence_dfs.append(pd.DataFrame(confidences))
+    return table_dfs, confidence_dfs
+
+
+def crop_cell(page, x1, y1, x2, y2, margin=CELL_MARGIN):
+    """
+    Crops a cell from a page, trimming a margin so the printed grid lines are left out.
+
+    :param page: Image as a numpy array
+    :param x1, y1, x2, y2: Cell box in pixels
+    :param margin: Pixels trimmed on each side when the cell is large enough
+    :return: Cell crop as a numpy array view
+    """
+    if x2 - x1 > 2 * margin and y2 - y1 > 2 * margin:
+        x1, y1, x2, y2 = x1 + margin, y1 + margin, x2 - margin, y2 - margin
+    return page[max(y1, 0):max(y2, 0), max(x1, 0):max(x2, 0)]
+
+
+def get_cell_boxes(img):
+    """
+    Detects tables with img2table without running OCR, only keeping the cell geometry.
+
+    :param img: img2table Image
+    :return: List of tables, each a list of rows of (x1, y1, x2, y2) cell boxes
+    """
+    tables = img.extract_tables(implicit_rows=False, borderless_tables=False)
+    return [
+        [[(cell.bbox.x1, cell.bbox.y1, cell.bbox.x2, cell.bbox.y2) for cell in row] for row in table.content.values()]
+        for table in tables
+    ]
+
+
+def crop_header(page, cell_boxes):
+    """
+    Crops the part of a page above its tables, where tally sheets print the data set, organisation unit and period,
+    so the sheet type can be read without running text detection over the tables.
+
+    :param page: Page as an RGB numpy array
+    :param cell_boxes: Tables of the page, as returned by get_cell_boxes
+    :return: Header crop, or the whole page when no table was found or the header is too low to read
+    """
+    tops = [box[1] for table in cell_boxes for row in table for box in row]
+    if not tops or min(tops) < MIN_HEADER_HEIGHT:
+        return page
+    return page[:int(min(tops))]
+
+
+def get_recognition_only_tabular_content(ocr_model, page, cell_boxes=None):
+    """
+    Reads tables by sending the crops of the cells found by img2table straight to the recognition model.
+    Most cells hold a single short number, so this skips the text detection model entirely.
+
+    Usage:
+    table_dfs, confidence_dfs = get_recognition_only_tabular_content(ocr_model, page)
+
+    :param ocr_model: docTR OCRPredictor, only its recognition predictor is used
+    :param page: Page as an RGB numpy array
+    :param cell_boxes: Tables of the page as returned by get_cell_boxes, detected here when not given
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    if cell_boxes is None:
+        cell_boxes = get_cell_boxes(ArrayImage(page))
+    tables = [[[crop_cell(page, *box) for box in row] for row in table] for table in cell_boxes]
+    return recognize_cell_crops(ocr_model, tables)
+
+
+def get_tabular_content(page, word_index):
+    """
+    Extracts tables with img2table and reads the text and confidence of every cell from the docTR words that lie
+    inside it, found with a box query on the word index, so both come from the same recognition and img2table
+    does not run OCR again.
+
+    Usage:
+    table_dfs, confidence_dfs = get_tabular_content(page, WordIndex.from_doctr_result(result))
+
+    :param page: Page as an RGB numpy array
+    :param word_index: WordIndex over the docTR words of the same page
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    table_dfs, confidence_dfs, _ = get_indexed_tabular_content(page, word_index)
+    return table_dfs, confidence_dfs
+
+
+def get_indexed_tabular_content(page, word_index):
+    """
+    Extracts tables with img2table's cell geometry only and reads every cell from the docTR words inside it, so the
+    page is not sent through OCR a second time. Also returns where each table is on the page.
+
+    Usage:
+    table_dfs, confidence_dfs, table_boxes = get_indexed_tabular_content(page, WordIndex.from_doctr_result(result))
+
+    :param page: Page as an RGB numpy array
+    :param word_index: WordIndex over the docTR words of the same page
+    :return: List of table dataframes, list of confidence dataframes and list of (x1, y1, x2, y2) table boxes
+    """
+    tables = ArrayImage(page).extract_tables(implicit_rows=False, borderless_tables=False)
+    table_dfs, confidence_dfs = read_indexed_cells(word_index, [
+        [[(cell.bbox.x1, cell.bbox.y1, cell.bbox.x2, cell.bbox.y2) for cell in row] for row in table.content.values()]
+        for table in tables
+    ])
+    table_boxes = [(table.bbox.x1, table.bbox.y1, table.bbox.x2, table.bbox.y2) for table in tables]
+    return table_dfs, confidence_dfs, table_boxes
+
+
+def read_indexed_cells(word_index, tables):
+    """
+    Reads the text and confidence of table cells from the docTR words inside them.
+
+    :param word_index: WordIndex over the docTR words of the page
+    :param tables: List of tables, each a list of rows of (x1, y1, x2, y2) cell boxes in page pixels
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    table_dfs, confidence_dfs = [], []
+    for table in tables:
+        cells = [[word_index.cell_content(box) for box in row] for row in table]
+        table_dfs.append(pd.DataFrame([[text for text, _ in row] for row in cells]))
+        confidence_dfs.append(pd.DataFrame([[confidence for _, confidence in row] for row in cells]))
+    return table_dfs, confidence_dfs
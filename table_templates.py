@@ -0,0 +1,235 @@
+"""
+Registry of known tally sheet layouts. Each template stores a reference image of the printed sheet and the
+cell geometry of its tables, so photos of a known sheet can be aligned to the template with a homography and
+their cells located directly, without running generic table detection. The cells are read from the words of the
+full page OCR, or cropped and recognized on their own in recognition-only mode.
+
+    templates/
+        vaccination/
+            template.png    <- clean scan of the printed sheet
+            layout.json     <- {"name": ..., "tables": [[[x1, y1, x2, y2], ...], ...], "min_matches": 40}
+
+Register a new layout from a clean scan with `python table_templates.py <name> <image>`.
+"""
+import argparse
+from dataclasses import dataclass
+import json
+import os
+from pathlib import Path
+import threading
+
+import cv2
+import numpy as np
+
+from table_extraction import crop_cell, read_indexed_cells, recognize_cell_crops
+
+TEMPLATE_DIR = os.environ.get("TABLE_TEMPLATE_DIR", "templates")
+TEMPLATE_IMAGE = "template.png"
+LAYOUT_FILE = "layout.json"
+FEATURE_MAX_SIDE = 1600
+MIN_MATCHES = 40
+ORB_FEATURES = 3000
+
+# OpenCV feature detectors and matchers are not thread-safe, so every Streamlit session or inference service
+# handler thread gets its own
+_feature_objects = threading.local()
+
+
+def _orb():
+    if not hasattr(_feature_objects, "orb"):
+        _feature_objects.orb = cv2.ORB_create(nfeatures=ORB_FEATURES)
+    return _feature_objects.orb
+
+
+def _matcher():
+    if not hasattr(_feature_objects, "matcher"):
+        _feature_objects.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+    return _feature_objects.matcher
+
+
+@dataclass
+class TableTemplate:
+    name: str
+    size: tuple
+    tables: list
+    keypoints: np.ndarray
+    descriptors: np.ndarray
+    min_matches: int = MIN_MATCHES
+
+
+def _features(image):
+    """
+    Computes ORB features on a downscaled grayscale copy of an image.
+
+    :param image: RGB image as a numpy array
+    :return: Keypoint coordinates in full resolution pixels and their descriptors
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+    scale = min(1.0, FEATURE_MAX_SIDE / max(gray.shape))
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    keypoints, descriptors = _orb().detectAndCompute(gray, None)
+    points = np.float32([kp.pt for kp in keypoints]) / scale
+    return points, descriptors
+
+
+def load_templates(template_dir=TEMPLATE_DIR):
+    """
+    Loads every registered template and precomputes the features of its reference image.
+
+    :param template_dir: Directory containing one sub-directory per template
+    :return: List of TableTemplate
+    """
+    templates = []
+    if not Path(template_dir).is_dir():
+        return templates
+    for layout_path in sorted(Path(template_dir).glob(f"*/{LAYOUT_FILE}")):
+        layout = json.loads(layout_path.read_text())
+        image = cv2.cvtColor(cv2.imread(str(layout_path.parent / TEMPLATE_IMAGE)), cv2.COLOR_BGR2RGB)
+        keypoints, descriptors = _features(image)
+        templates.append(TableTemplate(
+            name=layout["name"],
+            size=(image.shape[1], image.shape[0]),
+            tables=layout["tables"],
+            keypoints=keypoints,
+            descriptors=descriptors,
+            min_matches=layout.get("min_matches", MIN_MATCHES),
+        ))
+    return templates
+
+
+def match_template(page, templates):
+    """
+    Finds the registered template that a photo shows and the homography aligning the photo to it.
+
+    Usage:
+    match = match_template(page, load_templates())
+
+    :param page: RGB photo of a tally sheet as a numpy array
+    :param templates: List of TableTemplate
+    :return: (template, homography) for the best match, or None if the layout is unknown
+    """
+    if not templates:
+        return None
+    keypoints, descriptors = _features(page)
+    if descriptors is None:
+        return None
+    best = None
+    for template in templates:
+        pairs = _matcher().knnMatch(descriptors, template.descriptors, k=2)
+        # Lowe's ratio test to drop ambiguous matches
+        good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < 0.75 * p[1].distance]
+        if len(good) < template.min_matches:
+            continue
+        src = keypoints[[m.queryIdx for m in good]]
+        dst = template.keypoints[[m.trainIdx for m in good]]
+        homography, inliers = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+        if homography is None:
+            continue
+        n_inliers = int(inliers.sum())
+        if n_inliers >= template.min_matches and (best is None or n_inliers > best[2]):
+            best = (template, homography, n_inliers)
+    return best[:2] if best else None
+
+
+def crop_template_cells(page, template, homography):
+    """
+    Warps a photo into the template frame and crops every table cell.
+
+    :param page: RGB photo of a tally sheet as a numpy array
+    :param template: TableTemplate the photo was matched to
+    :param homography: Homography from photo pixels to template pixels
+    :return: List of crops per table, each a list of rows of numpy arrays
+    """
+    aligned = cv2.warpPerspective(page, homography, template.size)
+    return [[[crop_cell(aligned, *box) for box in row] for row in table] for table in template.tables]
+
+
+def page_cell_boxes(template, homography):
+    """
+    Maps the template cells back onto the photo. Each cell becomes the bounding box of its four mapped corners.
+
+    :param template: TableTemplate the photo was matched to
+    :param homography: Homography from photo pixels to template pixels
+    :return: List of tables, each a list of rows of (x1, y1, x2, y2) cell boxes in photo pixels
+    """
+    boxes = [box for table in template.tables for row in table for box in row]
+    if not boxes:
+        return [[] for _ in template.tables]
+    x1, y1, x2, y2 = np.float32(boxes).T
+    corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 1, 2)
+    mapped = cv2.perspectiveTransform(corners, np.linalg.inv(homography)).reshape(-1, 4, 2)
+    mapped_boxes = iter(np.concatenate([mapped.min(axis=1), mapped.max(axis=1)], axis=1).tolist())
+    return [[[tuple(next(mapped_boxes)) for _ in row] for row in table] for table in template.tables]
+
+
+def get_template_tabular_content(word_index, template, homography):
+    """
+    Reads the tables of a photo with a known layout from the docTR words inside its template cells, so the page
+    is neither warped nor recognized again.
+
+    Usage:
+    table_dfs, confidence_dfs = get_template_tabular_content(WordIndex.from_doctr_result(result), *match)
+
+    :param word_index: WordIndex over the docTR words of the photo
+    :param template: TableTemplate the photo was matched to
+    :param homography: Homography from photo pixels to template pixels
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    return read_indexed_cells(word_index, page_cell_boxes(template, homography))
+
+
+def get_recognition_only_template_tabular_content(ocr_model, page, template, homography):
+    """
+    Reads the tables of a photo with a known layout by recognizing its template cells in one batch, for when the
+    page was not read by the full OCR.
+
+    Usage:
+    table_dfs, confidence_dfs = get_recognition_only_template_tabular_content(ocr_model, page, *match)
+
+    :param ocr_model: docTR OCRPredictor, only its recognition predictor is used
+    :param page: RGB photo of a tally sheet as a numpy array
+    :param template: TableTemplate the photo was matched to
+    :param homography: Homography from photo pixels to template pixels
+    :return: List of table dataframes and list of confidence dataframes
+    """
+    return recognize_cell_crops(ocr_model, crop_template_cells(page, template, homography))
+
+
+def register_template(name, image_path, template_dir=TEMPLATE_DIR, min_matches=MIN_MATCHES):
+    """
+    Registers a layout from a clean scan, taking the cell geometry from img2table's table detection.
+
+    :param name: Name of the sheet type
+    :param image_path: Path to a clean, upright scan of the printed sheet
+    :param template_dir: Directory containing one sub-directory per template
+    :param min_matches: Number of RANSAC inliers needed to accept a photo as this layout
+    :return: Path to the template directory
+    """
+    from img2table.document import Image
+
+    tables = Image(src=str(image_path)).extract_tables(implicit_rows=False, borderless_tables=False)
+    if not tables:
+        raise ValueError(f"No tables were detected in {image_path}")
+    layout = {"name": name, "min_matches": min_matches, "tables": []}
+    for table in tables:
+        layout["tables"].append([
+            [[cell.bbox.x1, cell.bbox.y1, cell.bbox.x2, cell.bbox.y2] for cell in row]
+            for row in table.content.values()
+        ])
+
+    out_dir = Path(template_dir) / name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(out_dir / TEMPLATE_IMAGE), cv2.imread(str(image_path)))
+    (out_dir / LAYOUT_FILE).write_text(json.dumps(layout))
+    return out_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Register a tally sheet layout as a table template.")
+    parser.add_argument("name", help="Name of the sheet type, e.g. vaccination")
+    parser.add_argument("image", help="Clean, upright scan of the printed sheet")
+    parser.add_argument("--templates", default=TEMPLATE_DIR, help="Template registry directory")
+    parser.add_argument("--min-matches", type=int, default=MIN_MATCHES)
+    args = parser.parse_args()
+    print(f"Registered template in {register_template(args.name, args.image, args.templates, args.min_matches)}")
@@ -0,0 +1,100 @@
+"""
+Tests of the delta submission of data value sets against the local DHIS2 stand-in.
+
+Run from the repository root with `python -m pytest tests` or `python -m unittest discover tests`.
+"""
+import unittest
+
+import dhis2_submission
+from loadtest.stubs import DHIS2Handler, start_stub, stub_url
+
+AUTH = ("admin", "district")
+
+
+def make_payload(values):
+    """
+    :param values: Dict of data element id to value
+    :return: Data value set of one form
+    """
+    return {
+        "dataSet": "StubDataSet",
+        "period": "2024W1",
+        "orgUnit": "StubChildOrgUnit",
+        "dataValues": [{"dataElement": element, "categoryOptionCombo": "StubCOC", "value": value}
+                       for element, value in values.items()],
+    }
+
+
+class SubmitDataValuesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = start_stub(DHIS2Handler, conflicting_elements={"Retired"})
+        self.store = dhis2_submission.SubmissionStore()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def submit(self, values, **kwargs):
+        return dhis2_submission.submit_data_values(stub_url(self.server), AUTH, make_payload(values), self.store,
+                                                   dry_run=kwargs.get("dry_run", False),
+                                                   compress=kwargs.get("compress", True))
+
+    def sent_values(self):
+        """
+        :return: Dict of data element id to value of the last data value set the stub received
+        """
+        return {data_value["dataElement"]: data_value["value"]
+                for data_value in self.server.data_value_sets[-1]["dataValues"]}
+
+    def test_resubmission_only_sends_changed_values(self):
+        self.submit({"BCG": "1", "Measles": "2"})
+        self.assertEqual(self.sent_values(), {"BCG": "1", "Measles": "2"})
+
+        response, report = self.submit({"BCG": "1", "Measles": "3"})
+        self.assertTrue(response.ok)
+        self.assertEqual(self.sent_values(), {"Measles": "3"})
+        self.assertEqual((report["values"], report["values_sent"]), (2, 1))
+
+    def test_unchanged_resubmission_sends_nothing(self):
+        self.submit({"BCG": "1"})
+        response, report = self.submit({"BCG": "1"})
+        self.assertIsNone(response)
+        self.assertEqual(report["values_sent"], 0)
+        self.assertEqual(len(self.server.data_value_sets), 1)
+
+    def test_removed_value_is_sent_empty(self):
+        self.submit({"BCG": "1", "Measles": "2"})
+        self.submit({"BCG": "1"})
+        self.assertEqual(self.sent_values(), {"Measles": ""})
+
+        # The removal was imported, so the value is not sent again
+        response, _ = self.submit({"BCG": "1"})
+        self.assertIsNone(response)
+
+    def test_conflicting_values_are_sent_again(self):
+        response, _ = self.submit({"BCG": "1", "Retired": "5"})
+        self.assertEqual(response.json()["status"], "WARNING")
+
+        self.submit({"BCG": "1", "Retired": "5"})
+        self.assertEqual(self.sent_values(), {"Retired": "5"})
+
+    def test_dry_run_is_not_remembered(self):
+        self.submit({"BCG": "1"}, dry_run=True)
+        self.submit({"BCG": "1"})
+        self.assertEqual(self.sent_values(), {"BCG": "1"})
+
+    def test_expired_import_is_sent_in_full(self):
+        self.store.max_age = 0
+        self.submit({"BCG": "1", "Measles": "2"})
+        self.submit({"BCG": "1", "Measles": "3"})
+        self.assertEqual(self.sent_values(), {"BCG": "1", "Measles": "3"})
+
+    def test_uncompressed_body(self):
+        _, report = self.submit({"BCG": "1"}, compress=False)
+        self.assertEqual(self.server.bytes_received, report["bytes_sent"])
+        self.assertEqual(self.sent_values(), {"BCG": "1"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Spatial index over the words recognized by docTR, used to find the words and confidences inside a table cell.
+"""
+from collections import defaultdict
+
+import numpy as np
+
+DEFAULT_BUCKET_SIZE = 32
+MIN_OVERLAP = 0.5
+
+
+class WordIndex:
+    """
+    Uniform grid over word bounding boxes. Every word is stored in the buckets its box touches, so a cell
+    query only looks at the words near the cell instead of scanning every word of the page.
+
+    Usage:
+    index = WordIndex.from_doctr_result(result)
+    text, confidence = index.cell_content((x1, y1, x2, y2))
+    """
+
+    def __init__(self, boxes, values, confidences, bucket_size=None):
+        """
+        :param boxes: Word boxes as (x1, y1, x2, y2) in pixels
+        :param values: Recognized text of each word
+        :param confidences: Recognition confidence of each word
+        :param bucket_size: Side of a grid bucket in pixels, defaults to twice the median word height
+        """
+        self.boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.values = list(values)
+        self.confidences = list(confidences)
+        if bucket_size is None:
+            heights = self.boxes[:, 3] - self.boxes[:, 1]
+            bucket_size = max(2 * float(np.median(heights)), 1.0) if len(heights) else DEFAULT_BUCKET_SIZE
+        self.bucket_size = bucket_size
+        self.buckets = defaultdict(list)
+        for i, box in enumerate(self.boxes):
+            for key in self._bucket_keys(box):
+                self.buckets[key].append(i)
+
+    @classmethod
+    def from_doctr_result(cls, result, page_idx=0, bucket_size=None):
+        """
+        Builds the index from the words of one page of a docTR result.
+
+        :param result: docTR Document
+        :param page_idx: Index of the page in the document
+        :param bucket_size: Side of a grid bucket in pixels
+        :return: WordIndex in the pixel coordinates of the page
+        """
+        page = result.pages[page_idx]
+        height, width = page.dimensions
+        boxes, values, confidences = [], [], []
+        for block in page.blocks:
+            for line in block.lines:
+                for word in line.words:
+                    # Geometry is relative, either a box ((xmin, ymin), (xmax, ymax)) or a rotated polygon
+                    points = np.asarray(word.geometry, dtype=float) * (width, height)
+                    boxes.append((*points.min(axis=0), *points.max(axis=0)))
+                    values.append(word.value)
+                    confidences.append(word.confidence)
+        return cls(boxes, values, confidences, bucket_size)
+
+    def _bucket_keys(self, box):
+        x1, y1, x2, y2 = (int(v // self.bucket_size) for v in box)
+        return [(gx, gy) for gx in range(x1, x2 + 1) for gy in range(y1, y2 + 1)]
+
+    def query(self, box, min_overlap=MIN_OVERLAP):
+        """
+        Finds the words that lie inside a box.
+
+        :param box: (x1, y1, x2, y2) in pixels
+        :param min_overlap: Fraction of a word's area that must fall inside the box
+        :return: Indices of the matching words in reading order
+        """
+        candidates = {i for key in self._bucket_keys(box) for i in self.buckets.get(key, ())}
+        if not candidates:
+            return []
+        idx = np.fromiter(candidates, dtype=int)
+        words = self.boxes[idx]
+        inter_w = np.clip(np.minimum(words[:, 2], box[2]) - np.maximum(words[:, 0], box[0]), 0, None)
+        inter_h = np.clip(np.minimum(words[:, 3], box[3]) - np.maximum(words[:, 1], box[1]), 0, None)
+        area = np.maximum((words[:, 2] - words[:, 0]) * (words[:, 3] - words[:, 1]), 1e-9)
+        idx = idx[inter_w * inter_h / area >= min_overlap]
+        line_of = lambda i: int((self.boxes[i, 1] + self.boxes[i, 3]) / 2 // self.bucket_size)
+        return sorted(idx.tolist(), key=lambda i: (line_of(i), self.boxes[i, 0]))
+
+    def cell_content(self, box, min_overlap=MIN_OVERLAP):
+        """
+        Returns the text of the words inside a cell and the confidence of its weakest word.
+
+        :param box: Cell box as (x1, y1, x2, y2) in pixels
+        :param min_overlap: Fraction of a word's area that must fall inside the cell
+        :return: (text, confidence), or (None, None) for an empty cell
+        """
+        idx = self.query(box, min_overlap)
+        if not idx:
+            return None, None
+        return " ".join(self.values[i] for i in idx), min(self.confidences[i] for i in idx)